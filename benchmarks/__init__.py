@@ -0,0 +1,10 @@
+"""
+Synthetic-load benchmarks for the EAV datastore
+
+Execute:
+    python -m benchmarks --db postgresql://USER:PASS@/DATABASE
+
+Note that the benchmarks create (and drop) the datastore tables in the
+target database, so they refuse to run against a database that already
+contains any datastore tables.
+"""
@@ -0,0 +1,230 @@
+"""
+Times the datastore's hot paths against synthetic data
+"""
+
+import argparse
+from copy import deepcopy
+import random
+from timeit import default_timer
+
+from sqlalchemy import create_engine, inspect, orm
+
+from occams_datastore import models, reporting
+from occams_datastore.models.events import register
+
+from . import synthetic
+
+
+def parse_types(value):
+    """
+    Parses a type mix such as ``string=3,choice=2``
+
+    Raises:
+    argparse.ArgumentTypeError if the mix is malformed or contains a type
+    that cannot be generated (see ``synthetic.DEFAULT_TYPES``)
+    """
+    types = {}
+    for item in value.split(','):
+        try:
+            name, weight = item.split('=')
+            weight = int(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'Invalid type weight: %s' % item)
+        name = name.strip()
+        if name not in synthetic.DEFAULT_TYPES:
+            raise argparse.ArgumentTypeError(
+                'Unsupported type: %s (expected one of: %s)'
+                % (name, ', '.join(sorted(synthetic.DEFAULT_TYPES))))
+        if weight < 0:
+            raise argparse.ArgumentTypeError(
+                'Invalid type weight: %s' % item)
+        types[name] = weight
+    if not any(types.values()):
+        raise argparse.ArgumentTypeError('At least one type is required')
+    return types
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--db', action='append', required=True,
+        help='Database URL to benchmark (may be specified multiple times)')
+    parser.add_argument(
+        '--width', type=int, default=100,
+        help='Number of attributes in the schema')
+    parser.add_argument(
+        '--entities', type=int, default=1000,
+        help='Number of entities to generate')
+    parser.add_argument(
+        '--collection-ratio', type=float, default=0.2,
+        help='Fraction of choice attributes that are multiple-choice')
+    parser.add_argument(
+        '--choices', type=int, default=5,
+        help='Number of choices per choice attribute')
+    parser.add_argument(
+        '--types', type=parse_types, default=synthetic.DEFAULT_TYPES,
+        help='Attribute type mix (e.g. string=3,number=2,choice=2)')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Number of times to repeat the read-only benchmarks')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Random seed for reproducible data')
+    return parser
+
+
+class Timer(object):
+    """
+    Collects the timings of each benchmark
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def __call__(self, name, func, repeat=1):
+        times = []
+        for i in range(repeat):
+            start = default_timer()
+            func()
+            times.append(default_timer() - start)
+        times.sort()
+        self.results.append((name, times[0], times[len(times) // 2]))
+
+
+def benchmark(db_url, args):
+    """
+    Runs all benchmarks against a database
+
+    The datastore tables are created for the run and dropped afterwards,
+    so the database must not contain any datastore tables beforehand.
+
+    Returns:
+    A list of ``(name, best, median)`` timings in seconds
+
+    Raises:
+    RuntimeError if the database already contains datastore tables
+    """
+    engine = create_engine(db_url)
+    metadata = models.DataStoreModel.metadata
+
+    existing = sorted(
+        set(inspect(engine).get_table_names()) & set(metadata.tables))
+    if existing:
+        engine.dispose()
+        raise RuntimeError(
+            'Refusing to benchmark %s, it already contains datastore '
+            'tables: %s' % (db_url, ', '.join(existing)))
+
+    with engine.begin() as connection:
+        connection.info['blame'] = 'benchmark'
+        metadata.create_all(connection)
+
+    Session = orm.sessionmaker(bind=engine)
+    register(Session)
+    session = Session()
+
+    timer = Timer()
+    rand = random.Random(args.seed)
+
+    try:
+        session.info['blame'] = session.query(models.User).filter_by(
+            key='benchmark').one()
+
+        schema = synthetic.make_schema(
+            u'Benchmark', args.width,
+            collection_ratio=args.collection_ratio,
+            types=args.types,
+            choices=args.choices,
+            seed=args.seed)
+        session.add(schema)
+        session.flush()
+
+        timer('schema deepcopy', lambda: deepcopy(schema), args.repeat)
+
+        entities = []
+
+        def write():
+            entities.extend(synthetic.make_entities(
+                schema, args.entities, seed=args.seed))
+            session.add_all(entities)
+            session.flush()
+
+        timer('entity write', write)
+
+        attributes = [a for a in schema.iterleafs()
+                      if not a.is_collection]
+
+        def update():
+            for entity in entities:
+                attribute = rand.choice(attributes)
+                entity[attribute.name] = \
+                    synthetic.make_value(rand, attribute)
+            session.flush()
+
+        timer('entity update (audited)', update)
+
+        names = [a.name for a in schema.iterleafs()]
+
+        def read():
+            session.expire_all()
+            for entity in entities:
+                for name in names:
+                    entity[name]
+
+        timer('entity read', read, args.repeat)
+
+        def plan_cold():
+            reporting.invalidate_columns()
+            reporting.build_columns(session, u'Benchmark')
+
+        timer('build_columns (cold)', plan_cold, args.repeat)
+        timer('build_columns (cached)',
+              lambda: reporting.build_columns(session, u'Benchmark'),
+              args.repeat)
+
+        def report(**kw):
+            def run():
+                query = reporting.build_report(session, u'Benchmark', **kw)
+                session.query(query).all()
+            return run
+
+        timer('build_report', report(), args.repeat)
+        timer('build_report (expanded)',
+              report(expand_collections=True), args.repeat)
+
+        def pivot():
+            for batch in reporting.iter_pivot_report(session, u'Benchmark'):
+                pass
+
+        timer('iter_pivot_report', pivot, args.repeat)
+
+    finally:
+        session.rollback()
+        session.close()
+        reporting.invalidate_columns()
+        # Only tables created by this run, since none existed beforehand
+        metadata.drop_all(engine)
+        engine.dispose()
+
+    return timer.results
+
+
+def main(argv=None):
+    args = cli().parse_args(argv)
+    print('width=%d entities=%d collection_ratio=%s seed=%d' % (
+        args.width, args.entities, args.collection_ratio, args.seed))
+    for db_url in args.db:
+        print('')
+        print(db_url)
+        print('%-30s %12s %12s' % ('benchmark', 'best (s)', 'median (s)'))
+        try:
+            results = benchmark(db_url, args)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        for name, best, median in results:
+            print('%-30s %12.4f %12.4f' % (name, best, median))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Generators of synthetic schemata and entities
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import random
+
+from occams_datastore import models
+
+
+#: Default relative frequency of each attribute type
+DEFAULT_TYPES = {
+    'string': 3,
+    'text': 1,
+    'number': 2,
+    'date': 1,
+    'datetime': 1,
+    'choice': 3,
+}
+
+
+def make_schema(name,
+                width,
+                collection_ratio=0.2,
+                types=None,
+                choices=5,
+                section_size=25,
+                seed=0):
+    """
+    Generates a published schema of configurable width
+
+    Parameters:
+    name -- The name of the schema
+    width -- The number of (non-section) attributes
+    collection_ratio -- (Optional) The fraction of choice attributes that
+                        are multiple-choice
+    types -- (Optional) A dictionary of attribute type frequencies
+             (default: ``DEFAULT_TYPES``)
+    choices -- (Optional) The number of choices per choice attribute
+    section_size -- (Optional) The number of attributes per section
+    seed -- (Optional) The random seed, for reproducible schemata
+
+    Returns:
+    A new (transient) schema
+    """
+    rand = random.Random(seed)
+    types = types or DEFAULT_TYPES
+    population = [t for t, weight in sorted(types.items())
+                  for i in range(weight)]
+
+    schema = models.Schema(
+        name=name,
+        title=name,
+        publish_date=date.today())
+
+    section = None
+    for i in range(width):
+        if i % section_size == 0:
+            section = models.Attribute(
+                name=u's%d' % (i // section_size),
+                title=u'Section %d' % (i // section_size),
+                type='section',
+                order=i + i // section_size)
+            schema.attributes[section.name] = section
+
+        type_ = rand.choice(population)
+        attribute = models.Attribute(
+            name=u'q%d' % i,
+            title=u'Question %d' % i,
+            type=type_,
+            is_collection=(
+                type_ == 'choice' and rand.random() < collection_ratio),
+            order=i + i // section_size + 1)
+
+        if type_ == 'choice':
+            for j in range(choices):
+                code = u'%03d' % j
+                attribute.choices[code] = models.Choice(
+                    name=code, title=u'Choice %d' % j, order=j)
+
+        section.attributes[attribute.name] = attribute
+
+    return schema
+
+
+def make_value(rand, attribute):
+    """
+    Generates a random value suitable for the attribute
+    """
+    if attribute.type == 'choice':
+        codes = sorted(attribute.choices)
+        if attribute.is_collection:
+            return rand.sample(codes, rand.randint(1, len(codes)))
+        return rand.choice(codes)
+
+    if attribute.type == 'string':
+        value = u'value %d' % rand.randint(0, 10 ** 6)
+    elif attribute.type == 'text':
+        value = u'line %d\nline %d' % (rand.randint(0, 100),
+                                       rand.randint(0, 100))
+    elif attribute.type == 'number':
+        value = Decimal(rand.randint(0, 10 ** 6)) / 100
+    elif attribute.type == 'date':
+        value = date(2000, 1, 1) + timedelta(rand.randint(0, 5000))
+    elif attribute.type == 'datetime':
+        value = datetime(2000, 1, 1) + timedelta(
+            seconds=rand.randint(0, 10 ** 8))
+    else:
+        raise NotImplementedError(attribute.type)
+
+    return [value] if attribute.is_collection else value
+
+
+def make_entities(schema, count, fill_ratio=0.9, seed=0):
+    """
+    Generates entities populated through ``Entity.__setitem__``
+
+    Parameters:
+    schema -- The schema of the entities
+    count -- The number of entities to generate
+    fill_ratio -- (Optional) The fraction of attributes with a value
+    seed -- (Optional) The random seed, for reproducible values
+
+    Returns:
+    A list of new (transient) entities
+    """
+    rand = random.Random(seed)
+    attributes = list(schema.iterleafs())
+    entities = []
+    for i in range(count):
+        entity = models.Entity(schema=schema)
+        for attribute in attributes:
+            if rand.random() < fill_ratio:
+                entity[attribute.name] = make_value(rand, attribute)
+        entities.append(entity)
+    return entities
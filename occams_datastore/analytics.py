@@ -0,0 +1,163 @@
+"""
+Runs reports in an embedded DuckDB analytical database.
+
+A snapshot of the datastore is replicated into a DuckDB file (see
+``replicate``), report queries are then planned against the datastore as
+usual, but executed in DuckDB's vectorized columnar engine
+(see ``duckdb_report``).
+
+Requires the ``duckdb`` package.
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+import json
+
+import six
+from sqlalchemy import (
+    Boolean, Date, DateTime, Float, Integer, LargeBinary, Numeric)
+from sqlalchemy.dialects.postgresql.base import PGDialect
+from sqlalchemy.util import KeyedTuple
+
+from . import models, reporting
+from .utils.sql import compile_literal
+
+
+class DuckDBDialect(PGDialect):
+    """
+    Compiles statements for DuckDB, which largely follows PostgreSQL's SQL
+
+    This dialect is only used to compile statements, the vendor specific
+    compilation rules of DuckDB are registered for the name ``duckdb``
+    (see ``occams_datastore.utils.sql``).
+    """
+    name = 'duckdb'
+
+
+def connect(path):
+    """
+    Opens a DuckDB database file
+
+    Parameters:
+    path -- The path to the database file (``:memory:`` for a
+            temporary database)
+
+    Returns:
+    A DuckDB connection
+    """
+    # Imported on demand so that statements can be compiled for DuckDB
+    # without loading its native library
+    try:
+        import duckdb
+    except ImportError:  # pragma: nocover
+        raise ImportError('duckdb is required for analytical reports')
+    return duckdb.connect(path)
+
+
+def replicate(session, database, batch_size=10000, include_audit=False):
+    """
+    Replicates a snapshot of the datastore tables into a DuckDB database
+
+    Existing tables in the DuckDB database are replaced. Only the columns
+    are replicated (no constraints or indexes), and file contents are
+    replaced by a placeholder since only their presence is reported.
+
+    Parameters:
+    session -- The database session of the datastore to replicate
+    database -- The DuckDB connection to replicate into (see ``connect``)
+    batch_size -- (Optional) The number of rows to copy at a time
+    include_audit -- (Optional) Also replicates the audit tables, which are
+                     only necessary for ``build_deleted_report``
+                     (default is False)
+
+    Returns:
+    A dictionary of the number of rows copied for each table
+    """
+    connection = session.connection().execution_options(stream_results=True)
+    counts = {}
+
+    for table in models.DataStoreModel.metadata.sorted_tables:
+        if table.name.endswith('_audit') and not include_audit:
+            continue
+
+        database.execute('DROP TABLE IF EXISTS "%s"' % table.name)
+        database.execute('CREATE TABLE "%s" (%s)' % (
+            table.name,
+            ', '.join('"%s" %s' % (c.name, _duckdb_type(c.type))
+                      for c in table.columns)))
+
+        insert = 'INSERT INTO "%s" VALUES (%s)' % (
+            table.name, ', '.join(['?'] * len(table.columns)))
+
+        counts[table.name] = 0
+        result = connection.execute(table.select())
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            database.executemany(insert, [
+                [_duckdb_value(c.type, v) for c, v in zip(table.columns, row)]
+                for row in rows])
+            counts[table.name] += len(rows)
+
+    return counts
+
+
+def duckdb_report(session, database, schema_name, **kw):
+    """
+    Runs a schema's report in a DuckDB replica of the datastore
+
+    The report columns are planned using the session (which should be
+    the datastore the replica was created from), and the report query is
+    executed in the replica.
+
+    Parameters:
+    session -- The database session of the replicated datastore
+    database -- The DuckDB connection of the replica (see ``replicate``)
+    schema_name -- The name of the schema
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    A list of the report's rows ordered by entity id
+    """
+    statement = reporting._report_query(session, schema_name, **kw).statement
+    compiled = compile_literal(statement, DuckDBDialect())
+    cursor = database.execute(six.text_type(compiled))
+    labels = [d[0] for d in cursor.description]
+    return [KeyedTuple(row, labels) for row in cursor.fetchall()]
+
+
+def _duckdb_type(type_):
+    """
+    Helper method to map a column type to a DuckDB type
+    """
+    if isinstance(type_, Boolean):
+        return 'BOOLEAN'
+    if isinstance(type_, Integer):
+        return 'BIGINT'
+    if isinstance(type_, (Float, Numeric)):
+        return 'DOUBLE'
+    if isinstance(type_, DateTime):
+        return 'TIMESTAMP'
+    if isinstance(type_, Date):
+        return 'DATE'
+    return 'VARCHAR'
+
+
+def _duckdb_value(type_, value):
+    """
+    Helper method to convert a column value to a DuckDB parameter
+    """
+    if value is None:
+        return None
+    if isinstance(type_, LargeBinary):
+        return u'[FILE]'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
@@ -0,0 +1,492 @@
+"""
+File writers for exporting schema entity data reports.
+
+All writers stream the report in bounded batches (see
+``occams_datastore.reporting.iter_report``) so that memory use does not grow
+with the number of entities in the report.
+
+The columnar writers (Parquet and Arrow IPC) require ``pyarrow``.
+"""
+
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+import io
+import json
+import multiprocessing
+import os
+import shutil
+
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: nocover
+    from ordereddict import OrderedDict
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: nocover
+    pyarrow = None
+import six
+from six import itervalues, iteritems
+from sqlalchemy import (
+    create_engine, func, null, orm, Boolean, Date, DateTime, Integer, Numeric)
+
+from . import models, reporting
+
+
+def write_csv(session, schema_name, fileobj, batch_size=1000, **kw):
+    """
+    Writes a schema's report as comma-separated values
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    fileobj -- A file-like object to write to (open in binary mode
+               if using Python 2)
+    batch_size -- (Optional) The maximum number of rows to hold in memory
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    The number of rows written (excluding the header)
+    """
+    report = reporting.build_report(session, schema_name, **kw)
+    return _write_csv(session, report, fileobj, batch_size)
+
+
+def write_jsonl(session, schema_name, fileobj, batch_size=1000, **kw):
+    """
+    Writes a schema's report as JSON lines (one JSON object per entity)
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    fileobj -- A text file-like object to write to
+    batch_size -- (Optional) The maximum number of rows to hold in memory
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    The number of rows written
+    """
+    report = reporting.build_report(session, schema_name, **kw)
+    return _write_jsonl(session, report, fileobj, batch_size)
+
+
+def write_parquet(session,
+                  schema_name,
+                  fileobj,
+                  batch_size=10000,
+                  private='drop',
+                  **kw):
+    """
+    Writes a schema's report as a Parquet file (requires pyarrow)
+
+    Each batch of rows is written as its own row group as the rows are
+    streamed from the database.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    fileobj -- A file path or binary file-like object to write to
+    batch_size -- (Optional) The number of rows per row group
+    private -- (Optional) How to export ignored private columns, either
+               ``drop`` to leave them out or ``mask`` to keep them as
+               empty columns (default: drop)
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    The number of rows written
+    """
+    schema, batches = _arrow_batches(
+        session, schema_name, batch_size, private, **kw)
+    writer = pyarrow.parquet.ParquetWriter(fileobj, schema)
+    count = 0
+    try:
+        for batch in batches:
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+            count += batch.num_rows
+    finally:
+        writer.close()
+    return count
+
+
+def write_arrow(session,
+                schema_name,
+                fileobj,
+                batch_size=10000,
+                private='drop',
+                **kw):
+    """
+    Writes a schema's report as an Arrow IPC file (requires pyarrow)
+
+    Parameters are the same as ``write_parquet``, except that each batch is
+    written as a record batch of the file.
+
+    Returns:
+    The number of rows written
+    """
+    schema, batches = _arrow_batches(
+        session, schema_name, batch_size, private, **kw)
+    writer = pyarrow.RecordBatchFileWriter(fileobj, schema)
+    count = 0
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            count += batch.num_rows
+    finally:
+        writer.close()
+    return count
+
+
+def export_reports(db_url,
+                   schema_names,
+                   directory,
+                   processes=None,
+                   shard_size=None,
+                   format='csv',
+                   batch_size=1000,
+                   **kw):
+    """
+    Exports the reports of several schemata in parallel
+
+    The schemata (and entity id ranges within large schemata) are spread
+    across a pool of worker processes, each with its own database engine.
+    Every worker writes its shard to a partial file, the shards of each
+    schema are then merged in entity order, so the output is the same
+    regardless of the number of processes.
+
+    Parameters:
+    db_url -- The database URL the workers should connect to
+    schema_names -- The names of the schemata to export
+    directory -- The directory to write the ``<schema_name>.<format>``
+                 files to
+    processes -- (Optional) The number of worker processes
+                 (default: the number of CPUs)
+    shard_size -- (Optional) Splits schemata into shards of at most this
+                  many entities (default: one shard per schema)
+    format -- (Optional) Either ``csv`` or ``jsonl`` (default: csv)
+    batch_size -- (Optional) The maximum number of rows to hold in memory
+                  in each worker
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    The list of file paths written, in the order of ``schema_names``
+    """
+    if format not in _writers:
+        raise ValueError('Unsupported format: %s' % format)
+
+    engine = create_engine(db_url)
+    session = orm.sessionmaker(bind=engine)()
+    try:
+        tasks = []
+        for schema_name in schema_names:
+            bounds = _shard_bounds(session, schema_name, shard_size)
+            for i, (first, last) in enumerate(bounds):
+                path = os.path.join(
+                    directory, '%s.%s.%d' % (schema_name, format, i))
+                tasks.append((schema_name, first, last, path, i == 0,
+                              format, batch_size, kw))
+    finally:
+        session.close()
+        engine.dispose()
+
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(db_url,))
+    try:
+        shards = pool.map(_export_shard, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    paths = []
+    for schema_name in schema_names:
+        path = os.path.join(directory, '%s.%s' % (schema_name, format))
+        with open(path, 'wb') as target:
+            for shard_schema_name, shard_path in shards:
+                if shard_schema_name != schema_name:
+                    continue
+                with open(shard_path, 'rb') as source:
+                    shutil.copyfileobj(source, target)
+                os.remove(shard_path)
+        paths.append(path)
+
+    return paths
+
+
+def _shard_bounds(session, schema_name, shard_size=None):
+    """
+    Helper method to split a schema's entities into ranges of ids
+
+    Returns:
+    A list of ``(first, last)`` entity id bounds, where ``first`` is
+    inclusive and ``last`` is exclusive (``None`` means unbounded)
+    """
+    if not shard_size:
+        return [(None, None)]
+
+    numbered = (
+        session.query(
+            models.Entity.id.label('id'),
+            func.row_number().over(order_by=models.Entity.id).label('num'))
+        .join(models.Schema, models.Entity.schema)
+        .filter(models.Schema.name == schema_name)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .subquery())
+
+    starts = [
+        start for start, in
+        session.query(numbered.c.id)
+        .filter((numbered.c.num - 1) % shard_size == 0)
+        .order_by(numbered.c.id)]
+
+    if not starts:
+        return [(None, None)]
+
+    return list(zip([None] + starts[1:], starts[1:] + [None]))
+
+
+# Session factory of the current worker process
+_worker_sessionmaker = None
+
+
+def _init_worker(db_url):
+    """
+    Initializes a worker process with its own engine
+    """
+    global _worker_sessionmaker
+    _worker_sessionmaker = orm.sessionmaker(bind=create_engine(db_url))
+
+
+def _export_shard(task):
+    """
+    Writes the shard of a schema report to a partial file
+    """
+    (schema_name, first, last, path, header,
+     format, batch_size, kw) = task
+
+    session = _worker_sessionmaker()
+    try:
+        query = reporting._report_query(session, schema_name, **kw)
+        if first is not None:
+            query = query.filter(models.Entity.id >= first)
+        if last is not None:
+            query = query.filter(models.Entity.id < last)
+        report = query.subquery(schema_name)
+        with _open(path) as fileobj:
+            _writers[format](session, report, fileobj, batch_size, header)
+    finally:
+        session.close()
+
+    return schema_name, path
+
+
+def _open(path):
+    """
+    Opens a file for writing report text
+    """
+    if six.PY2:
+        return open(path, 'wb')
+    return io.open(path, 'w', encoding='utf-8', newline='')
+
+
+def _write_csv(session, report, fileobj, batch_size=1000, header=True):
+    """
+    Writes a report query as comma-separated values
+    """
+    writer = csv.writer(fileobj)
+    if header:
+        writer.writerow([_csv_value(c.name) for c in report.columns])
+    count = 0
+    for batch in reporting.iter_report(session, report, batch_size):
+        writer.writerows([_csv_value(v) for v in row] for row in batch)
+        count += len(batch)
+    return count
+
+
+def _write_jsonl(session, report, fileobj, batch_size=1000, header=True):
+    """
+    Writes a report query as JSON lines (JSON has no header)
+    """
+    names = [c.name for c in report.columns]
+    count = 0
+    for batch in reporting.iter_report(session, report, batch_size):
+        for row in batch:
+            line = json.dumps(OrderedDict(zip(names, row)),
+                              default=_json_value)
+            fileobj.write(six.text_type(line) + u'\n')
+        count += len(batch)
+    return count
+
+
+_writers = {
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+}
+
+
+def _arrow_batches(session, schema_name, batch_size, private='drop', **kw):
+    """
+    Helper method to convert a report to Arrow record batches
+
+    Column types are mapped from the report's data columns. Choices are
+    dictionary-encoded using the codes (or labels) of the column and are
+    decoded client-side from the choice ids reported by the database.
+
+    Returns:
+    A tuple of the Arrow schema and a generator of its record batches
+    """
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for columnar exports')
+
+    if private not in ('drop', 'mask'):
+        raise ValueError('Unsupported private column handling: %s' % private)
+
+    kw['use_choice_ids'] = True
+    use_choice_labels = kw.get('use_choice_labels', False)
+    ignore_private = kw.get('ignore_private', True)
+
+    columns = reporting.build_columns(
+        session,
+        schema_name,
+        kw.get('ids'),
+        kw.get('expand_collections', False),
+        attributes=kw.get('attributes'))
+    report = reporting.build_report(session, schema_name, **kw)
+
+    fields = []
+    converters = []
+    for i, report_column in enumerate(report.columns):
+        column = columns.get(report_column.name)
+        is_private = (
+            column is not None and column.is_private and ignore_private)
+        if is_private and private == 'drop':
+            continue
+        type_, convert = _arrow_type(
+            report_column, column, use_choice_labels)
+        if is_private:
+            convert = _arrow_nulls(type_)
+        fields.append(pyarrow.field(report_column.name, type_))
+        converters.append((i, convert))
+
+    schema = pyarrow.schema(fields)
+    names = [field.name for field in fields]
+
+    def batches():
+        for batch in reporting.iter_report(session, report, batch_size):
+            values = list(zip(*batch))
+            yield pyarrow.RecordBatch.from_arrays(
+                [convert(values[i]) for i, convert in converters], names)
+
+    return schema, batches()
+
+
+def _arrow_type(report_column, column, use_choice_labels=False):
+    """
+    Helper method to map a report column to an Arrow type and converter
+
+    Returns:
+    A tuple of the Arrow type and a function that converts a sequence of
+    report values to an Arrow array of that type
+    """
+    if column is not None and column.type == 'choice':
+        index = 1 if use_choice_labels else 0
+
+        if column.choice is not None:
+            if use_choice_labels:
+                return pyarrow.string(), _arrow_values(pyarrow.string())
+            return pyarrow.int8(), _arrow_values(pyarrow.int8())
+
+        if column.is_collection:
+            type_ = pyarrow.list_(pyarrow.string())
+            return type_, lambda values: pyarrow.array([
+                None if value is None else [
+                    column.choice_ids[int(choice_id)][index]
+                    for choice_id in value.split(';')]
+                for value in values], type=type_)
+
+        # Dictionary-encode using the column's terms
+        terms = sorted(set(
+            choice[index] for choice in itervalues(column.choice_ids)))
+        indexes = dict(
+            (choice_id, terms.index(choice[index]))
+            for choice_id, choice in iteritems(column.choice_ids))
+        type_ = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        dictionary = pyarrow.array(terms, type=pyarrow.string())
+        return type_, lambda values: pyarrow.DictionaryArray.from_arrays(
+            pyarrow.array(
+                [None if value is None else indexes[value]
+                 for value in values],
+                type=pyarrow.int32()),
+            dictionary)
+
+    if column is not None and column.type == 'number':
+        type_ = pyarrow.float64()
+        return type_, lambda values: pyarrow.array(
+            [None if value is None else float(value) for value in values],
+            type=type_)
+
+    sa_type = report_column.type
+    if column is not None and column.type in ('date', 'datetime'):
+        sa_type = Date() if column.type == 'date' else DateTime()
+
+    if isinstance(sa_type, (Boolean, Integer)):
+        type_ = pyarrow.int64()
+    elif isinstance(sa_type, Numeric):
+        type_ = pyarrow.float64()
+        return type_, lambda values: pyarrow.array(
+            [None if value is None else float(value) for value in values],
+            type=type_)
+    elif isinstance(sa_type, DateTime):
+        type_ = pyarrow.timestamp('us')
+    elif isinstance(sa_type, Date):
+        type_ = pyarrow.date32()
+    else:
+        type_ = pyarrow.string()
+
+    return type_, _arrow_values(type_)
+
+
+def _arrow_values(type_):
+    """
+    Helper method to generate a converter of plain values
+    """
+    return lambda values: pyarrow.array(list(values), type=type_)
+
+
+def _arrow_nulls(type_):
+    """
+    Helper method to generate a converter to an empty (all null) array
+    """
+    if isinstance(type_, pyarrow.DictionaryType):
+        dictionary = pyarrow.array([], type=type_.value_type)
+        return lambda values: pyarrow.DictionaryArray.from_arrays(
+            pyarrow.array([None] * len(values), type=type_.index_type),
+            dictionary)
+    return lambda values: pyarrow.array([None] * len(values), type=type_)
+
+
+def _csv_value(value):
+    """
+    Converts a report value to a CSV cell
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    if six.PY2:
+        if isinstance(value, six.text_type):
+            return value.encode('utf-8')
+        return str(value)
+    return value
+
+
+def _json_value(value):
+    """
+    Converts values the ``json`` module does not know about
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError('%r is not JSON serializable' % value)
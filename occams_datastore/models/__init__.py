@@ -16,9 +16,11 @@ class DataStoreModel(Base):
 from .auditing import Auditable  # NOQA
 from .metadata import User, Describeable, Modifiable, Referenceable  # NOQA
 from .schema import Schema, Category, Attribute, Choice  # NOQA
+from .report import ReportWatermark  # NOQA
 from .storage import (  # NOQA
     nameModelMap,
     State, Context, Entity,
+    load_entity_values,
     HasEntities,
     ValueString, ValueNumber, ValueDatetime, ValueText,
     ValueChoice, ValueBlob, BlobInfo)
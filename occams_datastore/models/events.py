@@ -1,8 +1,11 @@
 from sqlalchemy import event
+from sqlalchemy.orm import attributes
 
 from .metadata import updateMetadata, Modifiable
 from .auditing import createRevision, Auditable
+from .schema import Schema, Attribute, Choice
 from .storage import Entity, enforceSchemaState
+from ..reporting import invalidate_columns, refresh_report_views
 
 
 def onBeforeFlush(session, flush_context, instances):
@@ -25,6 +28,9 @@ def dispatch(instance, state):
     if isinstance(instance, Entity) and state in ('new', 'dirty'):
         enforceSchemaState(instance)
 
+    if isinstance(instance, (Schema, Attribute, Choice)):
+        invalidate_columns(getSchemaName(instance))
+
     if isinstance(instance, Modifiable) and state in ('new', 'dirty'):
         updateMetadata(instance, created=(state == 'new'))
 
@@ -41,8 +47,87 @@ def dispatch(instance, state):
             createRevision(instance, deleted=True)
 
 
+def getSchemaName(instance):
+    """
+    Returns the name of the schema a metadata instance belongs to,
+    or None if it cannot be determined (e.g. orphaned or renamed)
+    """
+    if isinstance(instance, Choice):
+        instance = instance.attribute
+    if isinstance(instance, Attribute):
+        instance = instance.schema
+    if instance is None or attributes.get_history(instance, 'name').deleted:
+        return None
+    return instance.name
+
+
 def register(session):
     """
     Registers event listeners.
     """
     event.listen(session, 'before_flush', onBeforeFlush)
+
+
+def onBeforeFlushReportViews(session, flush_context, instances):
+    """
+    Collects the schemata whose report views need to be regenerated
+    """
+    names = session.info.setdefault('report_views', set())
+    for collection in (session.new, session.dirty, session.deleted):
+        for instance in iter(collection):
+            if not isinstance(instance, (Schema, Attribute, Choice)):
+                continue
+            # Drafts don't have views, so editing them doesn't need to
+            # lock the views of the published versions
+            if not (isPublished(instance) or isPublishing(instance)):
+                continue
+            if isinstance(instance, Schema):
+                # Renamed schemata also need their old views dropped
+                names.update(attributes.get_history(instance, 'name').deleted)
+                names.add(instance.name)
+            else:
+                names.add(getSchemaName(instance))
+    names.discard(None)
+
+
+def isPublished(instance):
+    """
+    Returns whether a metadata instance belongs to a published version
+    that has not been retracted
+    """
+    if isinstance(instance, Choice):
+        instance = instance.attribute
+    if isinstance(instance, Attribute):
+        instance = instance.schema
+    return (
+        instance is not None
+        and instance.publish_date is not None
+        and instance.retract_date is None)
+
+
+def isPublishing(instance):
+    """
+    Returns whether a schema is being published or retracted
+    """
+    return isinstance(instance, Schema) and (
+        attributes.get_history(instance, 'publish_date').has_changes()
+        or attributes.get_history(instance, 'retract_date').has_changes())
+
+
+def onAfterFlushReportViews(session, flush_context):
+    """
+    Regenerates the report views of the schemata modified by the flush
+    """
+    names = session.info.pop('report_views', None)
+    if names:
+        refresh_report_views(session, names)
+
+
+def registerReportViews(session):
+    """
+    Registers event listeners that keep the report views
+    (see ``reporting.create_report_view``) up to date whenever a schema
+    is published, retracted or a published version is otherwise modified.
+    """
+    event.listen(session, 'before_flush', onBeforeFlushReportViews)
+    event.listen(session, 'after_flush_postexec', onAfterFlushReportViews)
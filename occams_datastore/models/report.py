@@ -0,0 +1,37 @@
+"""
+Report bookkeeping definitions
+"""
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from . import DataStoreModel
+
+
+class ReportWatermark(DataStoreModel):
+    """
+    Keeps track of the last refresh of a materialized report
+    (see ``reporting.materialize_report``)
+    """
+
+    __tablename__ = 'report_watermark'
+
+    name = Column(
+        String,
+        primary_key=True,
+        doc='The name of the materialized report table')
+
+    watermark = Column(
+        DateTime,
+        doc='Entities modified since this date need to be refreshed')
+
+    schema_modify_date = Column(
+        DateTime,
+        doc='The most recent modification of the schema\'s metadata')
+
+    schema_count = Column(
+        Integer,
+        doc='The number of rows of the schema\'s metadata')
+
+    schema_revision = Column(
+        Integer,
+        doc='The total of the revisions of the schema\'s metadata')
@@ -2,13 +2,17 @@
 Storage models
 """
 
+from collections import OrderedDict
 from decimal import Decimal
 from datetime import date
 from datetime import datetime
+from itertools import islice
 import re
 
+from six import iteritems, itervalues
 from sqlalchemy import (
     event,
+    inspect,
     text,
     Column,
     CheckConstraint,
@@ -16,6 +20,7 @@ from sqlalchemy import (
     Date, DateTime, Boolean, LargeBinary, Numeric, Integer,
     Unicode, UnicodeText, String)
 from sqlalchemy.orm import backref, relationship
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.collections import collection
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import declared_attr
@@ -59,32 +64,90 @@ class Context(DataStoreModel, Referenceable, Modifiable, Auditable):
             Index('ix_%s_external_key' % cls.__tablename__, 'external', 'key'))
 
 
+class GroupView(object):
+    """
+    Read-only view of the values of a group in a ``GroupedCollection``
+    """
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        self._values = values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) or index < 0:
+            return tuple(self._values)[index]
+        try:
+            return next(islice(self._values, index, None))
+        except StopIteration:
+            raise IndexError(index)
+
+    def __contains__(self, value):
+        return value in self._values
+
+    def __repr__(self):
+        return 'GroupView(%r)' % (list(self._values),)
+
+
 class GroupedCollection(object):
     """
     Collects relationship values into a dictionary grouped by a discriminator
+
+    Each group is an insertion-ordered set of its values, and the group of
+    every value is indexed so that values can be removed in constant time
+    while preserving the order of the remaining values.
     """
 
     def __init__(self, keyfunc):
         self._keyfunc = keyfunc
         self._groups = dict()
+        self._index = dict()
 
     @collection.appender
     def _append(self, value):
-        self._groups.setdefault(self._keyfunc(value), []).append(value)
+        key = self._keyfunc(value)
+        self._groups.setdefault(key, OrderedDict())[value] = None
+        self._index[value] = key
 
     def __setitem__(self, key, value):
         self._append(value)
 
     def __getitem__(self, key):
-        return tuple(value for value in self._groups.get(key, []))
+        return GroupView(self._groups.get(key, ()))
 
     def __delitem__(self, key):
         if key in self._groups:
-            list(map(self._remove, self[key]))
+            list(map(self._remove, list(self._groups[key])))
+
+    def items(self):
+        """
+        Lists the groups as (key, values) pairs
+        """
+        return [(key, GroupView(group)) for key, group in self._groups.items()]
+
+    def rekey(self, old, new):
+        """
+        Moves a group to a new key (e.g. once its discriminator is known)
+        """
+        if old in self._groups:
+            group = self._groups.setdefault(new, OrderedDict())
+            for value in self._groups.pop(old):
+                group[value] = None
+                self._index[value] = new
 
     @collection.remover
     def _remove(self, value):
-        self._groups[self._keyfunc(value)].remove(value)
+        key = self._index.pop(value)
+        group = self._groups[key]
+        del group[value]
+        if not group:
+            del self._groups[key]
 
     @collection.iterator
     def _iterator(self):
@@ -97,6 +160,26 @@ def grouped_collection(keyfunc):
     return lambda: GroupedCollection(keyfunc)
 
 
+def attributeKey(attribute):
+    """
+    Returns the key an attribute's values are grouped by in an entity
+
+    Values are grouped by attribute id so that the attribute of each value
+    doesn't need to be loaded. Attributes that have not been flushed yet
+    don't have an id and are grouped by the attribute itself instead.
+    """
+    return attribute.id if attribute.id is not None else attribute
+
+
+def valueKey(value):
+    """
+    Returns the key a value is grouped by in its entity (see ``attributeKey``)
+    """
+    if value.attribute_id is not None:
+        return value.attribute_id
+    return attributeKey(value.attribute)
+
+
 class State(DataStoreModel, Referenceable, Describeable, Modifiable, Auditable):
     """
     An entity state to keep track of the entity's progress through some
@@ -207,96 +290,226 @@ class Entity(DataStoreModel, Referenceable, Modifiable, Auditable):
             Index('ix_%s_state_id' % cls.__tablename__, 'state_id'),
             Index('ix_%s_collect_date' % cls.__tablename__, 'collect_date'))
 
-    def _getCollector(self, key):
-        type_ = self.schema.attributes[key].type
+    def _getCollector(self, attribute):
+        type_ = attribute.type
         if type_ == 'date':
             type_ = 'datetime'
         try:
-            return getattr(self, '_%s_values' % type_)
+            collector = getattr(self, '_%s_values' % type_)
         except AttributeError:  # pragma: no cover
             # Extreme edge case that is actually a programming error
             raise NotImplementedError(type_)
+        if attribute.id is not None:
+            # Values added before the attribute was flushed
+            collector.rekey(attribute, attribute.id)
+        return collector
 
     def __getitem__(self, key):
-        collector = self._getCollector(key)
         attribute = self.schema.attributes[key]
-
-        def convert(container):
-            if container.value is None:
-                value = None
-            elif container.attribute.type == 'date' \
-                    and isinstance(container.value, datetime):
-                # Sometimes it's converted to datetime and so we need to
-                # convert it back
-                value = container.value.date()
-            elif container.attribute.type == 'boolean':
-                value = bool(container.value)
-            elif container.attribute.type == 'choice':
-                value = container.value.name
-            else:
-                value = container.value
-            return value
+        collector = self._getCollector(attribute)
+        values = collector[attributeKey(attribute)]
 
         if attribute.is_collection:
-            value = [convert(v) for v in iter(collector[attribute.name])]
+            value = [unwrapValue(attribute, v) for v in values]
         else:
             try:
-                wrappedValue = collector[attribute.name][0]
+                wrappedValue = values[0]
             except IndexError:
                 value = None
             else:
-                value = convert(wrappedValue)
+                value = unwrapValue(attribute, wrappedValue)
         return value
 
     def __setitem__(self, key, value):
-        collector = self._getCollector(key)
-        attribute = self.schema.attributes[key]
+        self._setValue(self.schema.attributes[key], value)
+
+    def __delitem__(self, key):
+        self._delValue(self.schema.attributes[key])
+
+    def to_dict(self):
+        """
+        Returns the values of all the entity's attributes at once
+
+        Each value collection is only traversed once, instead of once per
+        attribute as when reading attributes individually.
+
+        Returns:
+        A dictionary of attribute names to values (sections are excluded)
+        """
+        attributes = dict(
+            (attributeKey(a), a) for a in itervalues(self.schema.attributes)
+            if a.type != 'section')
+
+        data = dict(
+            (a.name, [] if a.is_collection else None)
+            for a in itervalues(attributes))
+
+        collectors = set(map(self._getCollector, itervalues(attributes)))
+
+        for collector in collectors:
+            for key, values in collector.items():
+                attribute = attributes.get(key)
+                if attribute is None or not values:
+                    continue
+                if attribute.is_collection:
+                    data[attribute.name] = \
+                        [unwrapValue(attribute, v) for v in values]
+                else:
+                    data[attribute.name] = unwrapValue(attribute, values[0])
+
+        return data
+
+    def update(self, data):
+        """
+        Sets the values of several attributes at once
+
+        Parameters:
+        data -- A dictionary of attribute names to values (see ``__setitem__``)
+        """
+        attributes = self.schema.attributes
+        for key, value in iteritems(data):
+            self._setValue(attributes[key], value)
+
+    def _setValue(self, attribute, value):
+        collector = self._getCollector(attribute)
         wrapperFactory = nameModelMap[attribute.type]
 
         if value is None:
-            del self[key]
+            self._delValue(attribute)
             return
 
-        def convert(value, type_):
-            if value is None:
-                converted = None
-            elif type_ == 'boolean':
-                converted = int(value)
-            elif type_ == 'choice':
-                try:
-                    converted = attribute.choices[value]
-                except KeyError:
-                    raise ConstraintError(
-                        attribute.schema.name,
-                        attribute.name,
-                        [n for n in attribute.choices], value)
-            else:
-                converted = value
-            return converted
-
         if attribute.is_collection:
-            # don't even bother getting a diff, just create a new list
-            del self[key]
+            # Only add/remove the values that changed, so that unchanged
+            # values don't churn through the value and audit tables
+            existing = dict()
+            for wrappedValue in collector[attributeKey(attribute)]:
+                existing.setdefault(
+                    unwrapValue(attribute, wrappedValue), []
+                ).append(wrappedValue)
+            added = []
             for v in value:
-                convertedValue = convert(v, attribute.type)
-                collector[attribute.name] = wrapperFactory(
+                if existing.get(v):
+                    existing[v].pop()
+                else:
+                    added.append(convertValue(attribute, v))
+            removed = [w for ws in existing.values() for w in ws]
+            list(map(collector._remove, removed))
+            if removed:
+                self._touch()
+            for convertedValue in added:
+                collector[attributeKey(attribute)] = wrapperFactory(
                     attribute=attribute,
                     value=convertedValue)
         else:
             # For scalars, we're only dealing with one value, so it's OK to
             # try and update it
-            convertedValue = convert(value, attribute.type)
-            value_entries = collector[key]
+            convertedValue = convertValue(attribute, value)
+            value_entries = collector[attributeKey(attribute)]
             if value_entries:
                 value_entries[0].value = convertedValue
             else:
-                collector[attribute.name] = wrapperFactory(
+                collector[attributeKey(attribute)] = wrapperFactory(
                     attribute=attribute,
                     value=convertedValue)
 
-    def __delitem__(self, key):
-        collector = self._getCollector(key)
-        del collector[key]
+    def _delValue(self, attribute):
+        collector = self._getCollector(attribute)
+        if collector[attributeKey(attribute)]:
+            del collector[attributeKey(attribute)]
+            self._touch()
+
+    def _touch(self):
+        # Deleted values leave no rows behind, so the entity itself needs to
+        # be updated (bumping its ``modify_date``) for the change to be found
+        # by date (e.g. ``reporting.build_report(modified_since=...)``)
+        self.modify_date = text('CURRENT_TIMESTAMP')
+
+
+def unwrapValue(attribute, container):
+    """
+    Returns the value of an attribute from its value entry
+    """
+    if container.value is None:
+        value = None
+    elif attribute.type == 'date' and isinstance(container.value, datetime):
+        # Sometimes it's converted to datetime and so we need to
+        # convert it back
+        value = container.value.date()
+    elif attribute.type == 'boolean':
+        value = bool(container.value)
+    elif attribute.type == 'choice':
+        value = container.value.name
+    else:
+        value = container.value
+    return value
+
+
+def convertValue(attribute, value):
+    """
+    Converts a value of an attribute to what is stored in its value entry
+    """
+    if value is None:
+        converted = None
+    elif attribute.type == 'boolean':
+        converted = int(value)
+    elif attribute.type == 'choice':
+        try:
+            converted = attribute.choices[value]
+        except KeyError:
+            raise ConstraintError(
+                attribute.schema.name,
+                attribute.name,
+                [n for n in attribute.choices], value)
+    else:
+        converted = value
+    return converted
+
+
+def load_entity_values(session, entity_ids, batch_size=500):
+    """
+    Preloads the values of several entities at once
+
+    Instead of lazy-loading every value collection of every entity (one
+    query per value type per entity), the value rows of a batch of entities
+    are fetched with one query per value table and assigned directly to
+    the entities' value collections. Collections that are already loaded
+    (and may thus have pending changes) are left untouched.
+
+    Parameters:
+    session -- The database session
+    entity_ids -- The ids of the entities to load
+    batch_size -- (Optional) The number of entities to load per query
+
+    Returns:
+    The loaded entities, in the order of ``entity_ids``
+    """
+    entity_ids = list(entity_ids)
+    entities = {}
+    valueClasses = set(nameModelMap.values())
+
+    for i in range(0, len(entity_ids), batch_size):
+        batch = (
+            session.query(Entity)
+            .filter(Entity.id.in_(entity_ids[i:i + batch_size]))
+            .all())
+        entities.update((entity.id, entity) for entity in batch)
+
+        for valueClass in valueClasses:
+            key = '_%s_values' % valueClass.__typename__
+            groups = dict(
+                (entity.id, []) for entity in batch
+                if key in inspect(entity).unloaded)
+            if not groups:
+                continue
+            query = (
+                session.query(valueClass)
+                .filter(valueClass.entity_id.in_(list(groups))))
+            for value in query:
+                groups[value.entity_id].append(value)
+            for entity_id, values in groups.items():
+                set_committed_value(entities[entity_id], key, values)
+
+    return [entities[i] for i in entity_ids if i in entities]
 
 
 class HasEntities(object):
@@ -359,8 +572,7 @@ def TypeMappingClass(typeName, className, tableName, valueType, index=True):
                 primaryjoin='%s.entity_id == Entity.id' % cls.__name__,
                 backref=backref(
                     name='_%s_values' % cls.__typename__,
-                    collection_class=grouped_collection(
-                        lambda v: v.attribute.name),
+                    collection_class=grouped_collection(valueKey),
                     cascade='all, delete-orphan'))
 
         @declared_attr
@@ -7,11 +7,31 @@ try:
 except ImportError:  # pragma: nocover
     from ordereddict import OrderedDict
 
+from datetime import datetime
+import hashlib
+import json
+import operator
+import os
+import threading
+from timeit import default_timer
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
+import six
 from six import itervalues, iteritems
-from sqlalchemy import orm, cast, null, literal, Integer, case, Unicode
+from six.moves import cPickle as pickle
+from sqlalchemy import (
+    orm, cast, null, literal, case, func, inspect, select, union, union_all,
+    Column, MetaData, Table, Boolean, Date, DateTime, Integer, Numeric,
+    String, Unicode, UnicodeText)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import NullType
+from sqlalchemy.util import KeyedTuple
 
 from . import models
-from .utils.sql import group_concat, to_date, to_datetime
+from .utils.sql import compile_literal, group_concat, to_date, to_datetime
 
 
 def build_report(session,
@@ -21,7 +41,17 @@ def build_report(session,
                  expand_collections=False,
                  use_choice_labels=False,
                  context=None,
-                 ignore_private=True):
+                 ignore_private=True,
+                 chunk_size=None,
+                 modified_since=None,
+                 modified_until=None,
+                 profile=None,
+                 use_choice_ids=False,
+                 aggregate_collections=False,
+                 collection_arrays=False,
+                 filters=None,
+                 after_id=None,
+                 limit=None):
     """
     Builds a schema entity data report query table from the data dictioanry.
 
@@ -35,6 +65,46 @@ def build_report(session,
                          (default is False)
     use_choice_labels -- (Optional) Uses choice labels instead of codes
                          (default is False)
+    chunk_size -- (Optional) Joins the data columns in groups of this many
+                  columns, each as its own sub-query keyed on the entity id.
+                  Use this for very wide schemata that would otherwise
+                  exceed the vendor's join/planner limits.
+                  (default: if None, all columns are joined directly)
+    modified_since -- (Optional) Only include entities that were modified
+                      (or had values modified) on or after this date.
+                      Useful for delta extracts, see also
+                      ``build_deleted_report``.
+    modified_until -- (Optional) Only include entities that were modified
+                      (or had values modified) before this date.
+    profile -- (Optional) A ``ReportProfile`` to record the time spent
+               building the column plan and the query into
+               (see also ``profile_report``)
+    use_choice_ids -- (Optional) Reports the choice ids of (non-expanded)
+                      choice columns instead of joining the choice table
+                      for their codes or labels (collections are reported
+                      as delimited ids). Use ``decode_choices`` to convert
+                      the results client-side. (default is False)
+    aggregate_collections -- (Optional) Aggregates all (non-expanded)
+                             collection columns in a single grouped
+                             sub-query joined by entity, instead of a
+                             correlated sub-query per column.
+                             (default is False)
+    collection_arrays -- (Optional) Reports aggregated collections as
+                         native arrays instead of delimited strings
+                         (PostgreSQL only, implies
+                         ``aggregate_collections``). (default is False)
+    filters -- (Optional) Only include entities with values matching these
+               predicates, a dictionary of column names to ``(op, value)``
+               pairs, where op is one of ``=``, ``!=``, ``<``, ``<=``,
+               ``>``, ``>=`` or ``in`` (e.g. ``{'age': ('>=', 18)}``).
+               Choices are compared by code and collections match if any
+               of their values match. The predicates are applied to the
+               entities before the values are pivoted.
+    after_id -- (Optional) Only include entities with an id greater than
+                this one (i.e. the last id of the previous page)
+    limit -- (Optional) Only include this many entities. The limit is
+             applied to the entities before the values are pivoted,
+             see also ``report_page``.
 
     Returns:
     A SQLAlchemy aliased sub-query. Depending on the database driver,
@@ -47,132 +117,659 @@ def build_report(session,
     """
     is_sqlite = 'sqlite' == session.bind.url.drivername
 
+    start = default_timer()
+
+    query = _report_query(
+        session,
+        schema_name,
+        ids=ids,
+        attributes=attributes,
+        expand_collections=expand_collections,
+        use_choice_labels=use_choice_labels,
+        context=context,
+        ignore_private=ignore_private,
+        chunk_size=chunk_size,
+        modified_since=modified_since,
+        modified_until=modified_until,
+        profile=profile,
+        use_choice_ids=use_choice_ids,
+        aggregate_collections=aggregate_collections,
+        collection_arrays=collection_arrays,
+        filters=filters,
+        after_id=after_id,
+        limit=limit)
+
+    report = query.cte(schema_name) \
+        if not is_sqlite else query.subquery(schema_name)
+
+    if profile is not None:
+        profile.build_time = default_timer() - start
+
+    return report
+
+
+def profile_report(session, schema_name, explain=False, **kw):
+    """
+    Profiles the generation and execution of a report.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    explain -- (Optional) Also captures the query plan of the report.
+               On PostgreSQL this executes ``EXPLAIN (ANALYZE, BUFFERS)``
+               (which runs the query a second time), on SQLite this
+               executes ``EXPLAIN QUERY PLAN``.
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    A ``ReportProfile`` of the report
+    """
+    profile = ReportProfile()
+    report = build_report(session, schema_name, profile=profile, **kw)
+    statement = session.query(report).statement
+    dialect = session.bind.dialect
+
+    start = default_timer()
+    compiled = statement.compile(dialect=dialect)
+    profile.sql = six.text_type(compiled)
+    profile.compile_time = default_timer() - start
+
+    start = default_timer()
+    result = session.execute(statement)
+    profile.row_count = sum(1 for row in result)
+    profile.execute_time = default_timer() - start
+
+    if explain:
+        if dialect.name == 'postgresql':
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+        elif dialect.name == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            raise NotImplementedError(
+                'Cannot explain queries for %s' % dialect.name)
+        if dialect.positional:
+            params = [compiled.params[k] for k in compiled.positiontup]
+        else:
+            params = compiled.params
+        result = session.connection().execute(prefix + profile.sql, params)
+        profile.explain = [tuple(row) for row in result]
+
+    return profile
+
+
+def report_page(session, schema_name, after_id=None, page_size=50, **kw):
+    """
+    Fetches a page of a report using keyset pagination
+
+    Only the entities of the page are pivoted, so the cost of a page does
+    not depend on its position or the size of the report.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    after_id -- (Optional) The last entity id of the previous page
+                (default: if None, the first page is fetched)
+    page_size -- (Optional) The maximum number of rows in the page
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    A list of at most ``page_size`` rows ordered by entity id. The id of
+    the last row is the ``after_id`` of the next page, an empty list
+    means there are no more pages.
+    """
+    report = build_report(
+        session, schema_name, after_id=after_id, limit=page_size, **kw)
+    return session.query(report).order_by(report.c.id).all()
+
+
+def build_deleted_report(session, schema_name):
+    """
+    Builds a query of the deleted entities of a schema.
+
+    Deleted entities are determined from the ``entity_audit`` table. Note
+    that the time of deletion is not audited, so deleted entities cannot be
+    filtered by modification date and the complete list is always returned.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+
+    Returns:
+    A SQLAlchemy aliased sub-query with the deleted entity ``id``, its
+    ``form_name``, ``form_publish_date`` and the last audited
+    ``modify_date`` of the entity before it was deleted.
+    """
+    is_sqlite = 'sqlite' == session.bind.url.drivername
+
+    EntityAudit = models.Entity.__audit_mapper__.class_
+
     query = (
         session.query(
-            models.Entity.id.label('id'),
+            EntityAudit.id.label('id'),
             models.Schema.name.label('form_name'),
             models.Schema.publish_date.label('form_publish_date'),
-            models.State.name.label('state'),
-            models.Entity.collect_date.label('collect_date'),
-            cast(models.Entity.not_done, Integer).label('not_done'))
-        .outerjoin(models.State)
-        .join(models.Schema)
+            func.max(EntityAudit.modify_date).label('modify_date'))
+        .join(models.Schema, models.Schema.id == EntityAudit.schema_id)
         .filter(models.Schema.name == schema_name)
-        .filter(models.Schema.publish_date != null())
-        .filter(models.Schema.retract_date == null()))
+        .filter(~EntityAudit.id.in_(select([models.Entity.id])))
+        .group_by(
+            EntityAudit.id,
+            models.Schema.name,
+            models.Schema.publish_date)
+        .order_by(EntityAudit.id))
 
-    if ids:
-        query = query.filter(models.Schema.id.in_(ids))
+    name = '%s_deleted' % schema_name
 
-    if context:
-        query = (
+    return query.cte(name) if not is_sqlite else query.subquery(name)
+
+
+def _report_query(session,
+                  schema_name,
+                  ids=None,
+                  attributes=None,
+                  expand_collections=False,
+                  use_choice_labels=False,
+                  context=None,
+                  ignore_private=True,
+                  chunk_size=None,
+                  modified_since=None,
+                  modified_until=None,
+                  profile=None,
+                  use_choice_ids=False,
+                  aggregate_collections=False,
+                  collection_arrays=False,
+                  filters=None,
+                  after_id=None,
+                  limit=None):
+    """
+    Helper method to generate the ORM query behind ``build_report``
+
+    Entity criteria (e.g. ``models.Entity.id``) may be applied to the
+    resulting query, since the entity table is not aliased.
+    """
+    if collection_arrays and session.bind.dialect.name != 'postgresql':
+        raise NotImplementedError(
+            'Collection arrays are not supported in %s'
+            % session.bind.dialect.name)
+
+    query = _entity_query(session, schema_name, ids, context)
+
+    if modified_since is not None or modified_until is not None:
+        modified = _modified_query(
+            session, schema_name, modified_since, modified_until).alias()
+        query = query.filter(models.Entity.id.in_(select([modified.c.id])))
+
+    if filters:
+        query = _add_filters(
+            session, query, schema_name, ids, filters, ignore_private)
+
+    if after_id is not None:
+        query = query.filter(models.Entity.id > after_id)
+
+    if limit is not None:
+        # Select the page of entities before any values are joined
+        page = (
             query
-            .join(models.Context, (
-                (models.Context.external == context)
-                & (models.Context.entity_id == models.Entity.id)))
-            .add_column(models.Context.key.label('context_key')))
+            .with_entities(models.Entity.id.label('id'))
+            .order_by(models.Entity.id)
+            .limit(limit)
+            .subquery())
+        query = query.filter(models.Entity.id.in_(select([page.c.id])))
 
-    columns = build_columns(session, schema_name, ids, expand_collections)
+    columns = [
+        column for column in itervalues(
+            build_columns(session, schema_name, ids, expand_collections,
+                          profile=profile, attributes=attributes))
+        if column.type != 'section']  # Sections are not used in reports
 
-    attributes = None if attributes is None else set(attributes)
+    # Aggregated sub-queries only need to consider the reported entities,
+    # unless all of the schema's entities are reported anyway
+    entity_ids = None
+    if (context or filters or after_id is not None or limit is not None
+            or modified_since is not None or modified_until is not None):
+        entities = (
+            query
+            .with_entities(models.Entity.id.label('id'))
+            .subquery())
+        entity_ids = select([entities.c.id])
 
-    for column in itervalues(columns):
-        if column.type == 'section':  # Sections are not used in reports
-            continue
+    options = (
+        expand_collections, use_choice_labels, ignore_private, use_choice_ids,
+        aggregate_collections or collection_arrays, collection_arrays,
+        entity_ids)
 
-        if attributes is not None and column.name not in attributes:
-            continue
+    if not chunk_size:
+        query = _add_columns(session, query, columns, *options)
+
+    else:
+        # Each group of columns is joined as its own sub-query so that no
+        # single SELECT exceeds the vendor's join limits
+        schema_ids = set(a.schema_id for c in columns for a in c.attributes)
+        for i in range(0, len(columns), chunk_size):
+            group = columns[i:i + chunk_size]
+            chunk = (
+                session.query(models.Entity.id.label('id'))
+                .filter(models.Entity.schema_id.in_(schema_ids)))
+            if entity_ids is not None:
+                chunk = chunk.filter(models.Entity.id.in_(entity_ids))
+            chunk = _add_columns(session, chunk, group, *options)
+            chunk = chunk.subquery('%s_%d' % (schema_name, i // chunk_size))
+            query = (
+                query
+                .outerjoin(chunk, chunk.c.id == models.Entity.id)
+                .add_columns(*[chunk.c[c.name] for c in group]))
+
+    return _add_audit_columns(query).order_by(models.Entity.id)
+
+
+def _add_filters(session,
+                 query,
+                 schema_name,
+                 ids=None,
+                 filters=None,
+                 ignore_private=True):
+    """
+    Helper method to filter a report's entities by their values
+
+    Each predicate is added as a correlated ``EXISTS`` on the value table,
+    so the database can probe its attribute/value indexes rather than
+    computing the entire report first.
+
+    Parameters:
+    session -- The database session to use
+    query -- The query containing the ``Entity`` to report on
+    (the remaining parameters are the same as ``build_report``)
+
+    Returns:
+    The filtered query
+
+    Raises:
+    ValueError if a predicate refers to an unknown column, operator,
+    or choice code, if it filters a private or file column or if an
+    ``in`` predicate's value is not a sequence
+    """
+    columns = build_columns(session, schema_name, ids, attributes=filters)
+
+    for name, (op, value) in sorted(iteritems(filters)):
+        if name not in columns:
+            raise ValueError('Unknown filter column: %s' % name)
+
+        column = columns[name]
+
+        if op not in _filter_operators:
+            raise ValueError('Unknown filter operator: %s' % op)
 
         if column.is_private and ignore_private:
-            query = query.add_column(literal(u'[PRIVATE]').label(column.name))
-            continue
+            raise ValueError('Cannot filter private column: %s' % name)
+
+        if column.type == 'blob':
+            raise ValueError('Cannot filter file column: %s' % name)
+
+        if op == 'in':
+            if isinstance(value, six.string_types) \
+                    or not hasattr(value, '__iter__'):
+                raise ValueError(
+                    'Filter operator "in" requires a sequence: %s' % name)
+            values = list(value)
+        else:
+            values = [value]
 
-        # evaluate the target mapped class and casted value column
         Value = orm.aliased(models.nameModelMap[column.type])
+
+        if column.type == 'choice':
+            if op not in ('=', '!=', 'in'):
+                raise ValueError(
+                    'Cannot compare choice column: %s %s' % (name, op))
+            unknown = set(values) - set(column.choices)
+            if unknown:
+                raise ValueError(
+                    'Unknown choices for %s: %s'
+                    % (name, ', '.join(sorted(map(six.text_type, unknown)))))
+            # Compare the choice ids directly to avoid joining the choices
+            values = [
+                choice_id
+                for choice_id, (code, title) in iteritems(column.choice_ids)
+                if code in values]
+            condition = Value._value.in_(values)
+            if op == '!=':
+                condition = ~condition
+        elif op == 'in':
+            condition = Value._value.in_(values)
+        else:
+            condition = _filter_operators[op](Value._value, value)
+
+        query = query.filter(
+            session.query(Value)
+            .filter(Value.entity_id == models.Entity.id)
+            .filter(Value.attribute_id.in_([a.id for a in column.attributes]))
+            .filter(condition)
+            .correlate(models.Entity)
+            .exists())
+
+    return query
+
+
+_filter_operators = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': None,  # Handled separately, as the value is a list
+}
+
+
+def _add_columns(session,
+                 query,
+                 columns,
+                 expand_collections=False,
+                 use_choice_labels=False,
+                 ignore_private=True,
+                 use_choice_ids=False,
+                 aggregate_collections=False,
+                 collection_arrays=False,
+                 entity_ids=None):
+    """
+    Helper method to add data columns to a report query
+
+    Expanded collection columns are added from a single aggregate of
+    their collection's values per entity (see ``_collection_flags``).
+    If requested, the remaining collection columns are added from a single
+    aggregate of all collections (see ``_collection_values``).
+    All other columns are added individually via ``_add_column``.
+
+    Parameters:
+    session -- The database session to use
+    query -- The query containing the ``Entity`` to report on
+    columns -- The ``DataColumn`` list to add
+    entity_ids -- (Optional) A select of the ids of the reported entities,
+                  used to restrict the aggregated sub-queries
+                  (default: if None, all entities are aggregated)
+    (the remaining parameters are the same as ``build_report``)
+
+    Returns:
+    The query with the columns added
+    """
+    flags = {}
+    aggregated = [
+        column for column in columns
+        if aggregate_collections
+        and column.is_collection
+        and column.type == 'choice'
+        and column.choice is None
+        and not (column.is_private and ignore_private)]
+    values = None
+
+    for column in columns:
+        if column in aggregated:
+            if values is None:
+                values = _collection_values(
+                    session, aggregated, use_choice_labels, use_choice_ids,
+                    collection_arrays, entity_ids)
+                query = query.outerjoin(
+                    values, values.c.entity_id == models.Entity.id)
+            query = query.add_column(
+                values.c[column.name].label(column.name))
+            continue
+
+        if (column.choice is None
+                or (column.is_private and ignore_private)):
+            query = _add_column(
+                session, query, column, expand_collections,
+                use_choice_labels, ignore_private, use_choice_ids)
+            continue
+
+        key = tuple(a.id for a in column.attributes)
+
+        if key not in flags:
+            flags[key] = _collection_flags(session, [
+                c for c in columns
+                if c.choice is not None
+                and tuple(a.id for a in c.attributes) == key], entity_ids)
+            query = query.outerjoin(
+                flags[key], flags[key].c.entity_id == models.Entity.id)
+
+        value_column = flags[key].c[column.name]
+
+        if use_choice_labels:
+            value_column = case([(
+                value_column == 1,
+                cast(literal(column.choice.title), Unicode))])
+
+        query = query.add_column(value_column.label(column.name))
+
+    return query
+
+
+def _collection_flags(session, columns, entity_ids=None):
+    """
+    Helper method to aggregate the expanded columns of a collection
+
+    Each entity's selections are aggregated once, rather than probing each
+    choice of the collection with its own correlated sub-queries.
+
+    Parameters:
+    session -- The database session to use
+    columns -- The expanded ``DataColumn`` list of a single collection
+    entity_ids -- (Optional) A select of the entity ids to aggregate
+                  (default: if None, all entities are aggregated)
+
+    Returns:
+    A sub-query of ``entity_id`` and a flag column per expanded column
+    (1 if selected, 0 if not selected and NULL if nothing was selected)
+    """
+    Value = orm.aliased(models.ValueChoice)
+    attribute_ids = [a.id for a in columns[0].attributes]
+
+    flag_columns = []
+    for column in columns:
+        # Match the choice ids directly, no need to join the choice
+        # table for the (already known) code
+        choice_ids = [
+            choice_id
+            for choice_id, (name, title) in iteritems(column.choice_ids)
+            if name == column.choice.name]
+        flag_columns.append(
+            func.max(case([(Value._value.in_(choice_ids), 1)], else_=0))
+            .label(column.name))
+
+    query = (
+        session.query(Value.entity_id.label('entity_id'), *flag_columns)
+        .filter(Value.attribute_id.in_(attribute_ids)))
+
+    if entity_ids is not None:
+        query = query.filter(Value.entity_id.in_(entity_ids))
+
+    return query.group_by(Value.entity_id).subquery()
+
+
+def _collection_values(session,
+                       columns,
+                       use_choice_labels=False,
+                       use_choice_ids=False,
+                       collection_arrays=False,
+                       entity_ids=None):
+    """
+    Helper method to aggregate the values of (non-expanded) collections
+
+    The choice values of all the collections are scanned once and grouped
+    by entity, rather than each column correlating its own sub-query.
+
+    Parameters:
+    session -- The database session to use
+    columns -- The (non-expanded) collection ``DataColumn`` list
+    entity_ids -- (Optional) A select of the entity ids to aggregate
+                  (default: if None, all entities are aggregated)
+    (the remaining parameters are the same as ``build_report``)
+
+    Returns:
+    A sub-query of ``entity_id`` and an aggregate column per collection
+    (NULL if nothing was selected)
+    """
+    Value = orm.aliased(models.ValueChoice)
+    Choice = orm.aliased(models.Choice)
+
+    query = session.query(Value.entity_id.label('entity_id'))
+
+    if use_choice_ids:
         value_column = Value._value
+        text_column = cast(Value._value, Unicode)
+    else:
+        query = query.join(Choice, Value._value == Choice.id)
+        value_column = Choice.title if use_choice_labels else Choice.name
+        text_column = value_column
 
-        if column.type in ('date', 'datetime'):
-            # Cast datetimes to match their attribute types
-            conv = to_date if column.type == 'date' else to_datetime
-            value_column = conv(Value._value)
+    attribute_ids = []
+    for column in columns:
+        column_ids = [a.id for a in column.attributes]
+        attribute_ids.extend(column_ids)
+        selected = Value.attribute_id.in_(column_ids)
+        if collection_arrays:
+            aggregate = (
+                func.array_agg(value_column, type_=ARRAY(value_column.type))
+                .filter(selected))
+        else:
+            # Empty concatenations of the other columns' values become NULL
+            aggregate = func.nullif(
+                group_concat(case([(selected, text_column)]), ';'),
+                u'',
+                type_=UnicodeText)
+        query = query.add_column(aggregate.label(column.name))
 
-        if column.type == 'blob':
-            value_column = case(
-                whens=[((value_column != null()), literal(u'[FILE]'))],
-                else_=null())
+    query = query.filter(Value.attribute_id.in_(attribute_ids))
 
-        filter_expression = (
-            (models.Entity.id == Value.entity_id)
-            & (Value.attribute_id.in_([a.id for a in column.attributes])))
+    if entity_ids is not None:
+        query = query.filter(Value.entity_id.in_(entity_ids))
 
-        Choice = orm.aliased(models.Choice)
+    return query.group_by(Value.entity_id).subquery()
 
-        if column.is_collection:
-            # Collections are added via correlated sub-queries to the entity
-            if not expand_collections:
 
-                if use_choice_labels:
-                    value_column = Choice.title
-                else:
-                    value_column = Choice.name
-
-                # Not all vendors suppoar ARRAY, so we just concatenate the
-                # and let clients deal with spliting
-                value_column = (
-                    session.query(group_concat(value_column, ';'))
-                    .select_from(Value)
-                    .filter(filter_expression)
-                    .join(Choice)
-                    .group_by(Value.attribute_id)
-                    .correlate(models.Entity)
-                    .as_scalar())
+def _add_column(session,
+                query,
+                column,
+                expand_collections=False,
+                use_choice_labels=False,
+                ignore_private=True,
+                use_choice_ids=False):
+    """
+    Helper method to add a data column to a report query
 
-            else:
-                selected_exists = (
-                    session.query(Value)
-                    .join(Choice, Value._value == Choice.id)
-                    .filter(filter_expression)
-                    .filter(Choice.name == column.choice.name)
-                    .correlate(models.Entity)
-                    .exists())
-
-                if use_choice_labels:
-                    selected_value_column = (
-                        session.query(
-                            cast(literal(column.choice.title), Unicode))
-                        .filter(selected_exists)
-                        .as_scalar())
-                else:
-                    selected_value_column = (
-                        session.query(cast(selected_exists, Integer))
-                        .as_scalar())
+    Parameters:
+    session -- The database session to use
+    query -- The query containing the ``Entity`` to report on
+    column -- The ``DataColumn`` to add
+    (the remaining parameters are the same as ``build_report``)
 
-                is_selected = (
-                    session.query(Value)
-                    .filter(filter_expression)
-                    .correlate(models.Entity)
-                    .exists())
+    Returns:
+    The query with the column added
+    """
+    if column.is_private and ignore_private:
+        return query.add_column(literal(u'[PRIVATE]').label(column.name))
+
+    # evaluate the target mapped class and casted value column
+    Value = orm.aliased(models.nameModelMap[column.type])
+    value_column = Value._value
+
+    if column.type in ('date', 'datetime'):
+        # Cast datetimes to match their attribute types
+        conv = to_date if column.type == 'date' else to_datetime
+        value_column = conv(Value._value)
 
-                value_column = case([(is_selected, selected_value_column)])
+    if column.type == 'blob':
+        value_column = case(
+            whens=[((value_column != null()), literal(u'[FILE]'))],
+            else_=null())
 
+    filter_expression = (
+        (models.Entity.id == Value.entity_id)
+        & (Value.attribute_id.in_([a.id for a in column.attributes])))
+
+    Choice = orm.aliased(models.Choice)
+
+    if column.is_collection:
+        # Collections are added via correlated sub-queries to the entity
+        # (expanded collections are added by ``_add_columns``)
+        values = (
+            session.query(Value)
+            .filter(filter_expression)
+            .group_by(Value.attribute_id)
+            .correlate(models.Entity))
+
+        if use_choice_ids:
+            value_column = cast(Value._value, Unicode)
         else:
-            # Scalar columns are added via LEFT OUTER JOIN
-            query = query.outerjoin(Value, filter_expression)
-
-            if column.type == 'choice':
-                Choice = orm.aliased(models.Choice)
-                query = query.outerjoin(Choice, Value._value == Choice.id)
-                if use_choice_labels:
-                    value_column = Choice.title
-                else:
-                    value_column = Choice.name
+            values = values.join(Choice)
+            if use_choice_labels:
+                value_column = Choice.title
+            else:
+                value_column = Choice.name
 
-        query = query.add_column(value_column.label(column.name))
+        # Not all vendors suppoar ARRAY, so we just concatenate the
+        # and let clients deal with spliting
+        value_column = (
+            values
+            .with_entities(group_concat(value_column, ';'))
+            .as_scalar())
+
+    else:
+        # Scalar columns are added via LEFT OUTER JOIN
+        query = query.outerjoin(Value, filter_expression)
+
+        if column.type == 'choice' and not use_choice_ids:
+            Choice = orm.aliased(models.Choice)
+            query = query.outerjoin(Choice, Value._value == Choice.id)
+            if use_choice_labels:
+                value_column = Choice.title
+            else:
+                value_column = Choice.name
+
+    return query.add_column(value_column.label(column.name))
+
+
+def _entity_query(session, schema_name, ids=None, context=None):
+    """
+    Helper method to generate the entity metadata query of a report
+
+    The returned query only contains the leading metadata columns of the
+    report, data columns are expected to be added by the caller.
+    """
+    query = (
+        session.query(
+            models.Entity.id.label('id'),
+            models.Schema.name.label('form_name'),
+            models.Schema.publish_date.label('form_publish_date'),
+            models.State.name.label('state'),
+            models.Entity.collect_date.label('collect_date'),
+            cast(models.Entity.not_done, Integer).label('not_done'))
+        .outerjoin(models.State)
+        .join(models.Schema)
+        .filter(models.Schema.name == schema_name)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null()))
+
+    if ids:
+        query = query.filter(models.Schema.id.in_(ids))
+
+    if context:
+        query = (
+            query
+            .join(models.Context, (
+                (models.Context.external == context)
+                & (models.Context.entity_id == models.Entity.id)))
+            .add_column(models.Context.key.label('context_key')))
+
+    return query
 
+
+def _add_audit_columns(query):
+    """
+    Helper method to append the trailing entity audit columns of a report
+    """
     CreateUser = orm.aliased(models.User)
     ModifyUser = orm.aliased(models.User)
 
-    query = (
+    return (
         query
         .join(CreateUser, models.Entity.create_user)
         .join(ModifyUser, models.Entity.modify_user)
@@ -180,14 +777,15 @@ def build_report(session,
             models.Entity.create_date,
             CreateUser.key.label('create_user'),
             models.Entity.modify_date,
-            ModifyUser.key.label('modify_user'))
-        .order_by(models.Entity.id))
-
-    return query.cte(schema_name) \
-        if not is_sqlite else query.subquery(schema_name)
+            ModifyUser.key.label('modify_user')))
 
 
-def build_columns(session, schema_name, ids=None, expand_collections=False):
+def build_columns(session,
+                  schema_name,
+                  ids=None,
+                  expand_collections=False,
+                  profile=None,
+                  attributes=None):
     """
     Helper method to determine the columns of the report to generate
 
@@ -205,12 +803,60 @@ def build_columns(session, schema_name, ids=None, expand_collections=False):
     ids -- (Optional) Specific id numbers of the forms
     expand_collections -- (Optional) Also expands multiple choice attributes
                          into individual "flag" boolean columns.
+    profile -- (Optional) A ``ReportProfile`` to record the planning time into
+    attributes -- (Optional) Only plan the specified column names
+                  (default: if None, all columns will be planned).
+                  Only the lineages of these columns are loaded.
 
     Returns:
     An ordered dictionary using the path to the attribute as the key,
     and the associated attribute list as the value. The path will
     also contain the attribute's checksum.
+
+    Developer note: the resulting plans are cached for the life of the
+    process (see ``invalidate_columns``), subsequent calls only need to
+    check that the schema's metadata has not changed and look up the
+    planned attributes by primary key.
+    """
+    start = default_timer()
+    columns = _plan_columns(
+        session, schema_name, ids, expand_collections, attributes)
+    if profile is not None:
+        profile.plan_time = default_timer() - start
+    return columns
+
+
+def _plan_columns(session,
+                  schema_name,
+                  ids=None,
+                  expand_collections=False,
+                  attributes=None):
+    """
+    Helper method to generate the (cached) columns of ``build_columns``
     """
+    attributes = None if attributes is None else set(attributes)
+
+    key = (schema_name, tuple(sorted(ids)) if ids else None,
+           expand_collections,
+           tuple(sorted(attributes)) if attributes is not None else None)
+
+    # Plans may have been cached from another transaction (including ones
+    # that were rolled back or not committed yet), so only reuse plans of
+    # the same version of the schema's metadata
+    watermark = _schema_watermark(session, schema_name)
+
+    with _column_plans_lock:
+        cached = _column_plans.pop(key, None)
+        if cached is not None:
+            # Re-insert as the most recently used
+            _column_plans[key] = cached
+    if cached is not None and cached[0] == watermark:
+        columns = _load_columns(session, cached[1])
+        if columns is not None:
+            return columns
+
+    if attributes is not None and not attributes:
+        return OrderedDict()
 
     query = (
         session.query(models.Attribute)
@@ -223,6 +869,16 @@ def build_columns(session, schema_name, ids=None, expand_collections=False):
     if ids:
         query = query.filter(models.Schema.id.in_(ids))
 
+    if attributes is not None:
+        # Expanded columns are named after their attribute (e.g. ``a_001``),
+        # so also look for any attribute named after a column's prefix
+        names = set()
+        for name in attributes:
+            parts = name.split('_')
+            for i in range(1, len(parts) + 1):
+                names.add('_'.join(parts[:i]))
+        query = query.filter(models.Attribute.name.in_(names))
+
     # aliased so we don't get naming ambiguity
     RecentAttribute = orm.aliased(models.Attribute)
 
@@ -258,12 +914,1010 @@ def build_columns(session, schema_name, ids=None, expand_collections=False):
             plan.setdefault(attribute.name, []).append(attribute)
 
     # Build the final plan
-    for name, attributes in iteritems(plan):
-        columns[name] = DataColumn(name, attributes, selected.get(name))
+    for name, lineage in iteritems(plan):
+        if attributes is None or name in attributes:
+            columns[name] = DataColumn(name, lineage, selected.get(name))
+
+    cached = (watermark, [
+        (column.name,
+         [a.id for a in column.attributes],
+         column.choice and (column.choice.attribute.id, column.choice.name))
+        for column in itervalues(columns)])
+
+    with _column_plans_lock:
+        _column_plans.pop(key, None)
+        _column_plans[key] = cached
+        while len(_column_plans) > COLUMN_PLANS_MAX_SIZE:
+            _column_plans.popitem(last=False)
+
+    return columns
+
+
+# Process-wide column plans, keyed by
+# (schema_name, ids, expand_collections, attributes), along with the
+# metadata watermark they were planned from (see ``_schema_watermark``),
+# in least-recently-used order
+_column_plans = OrderedDict()
+_column_plans_lock = threading.Lock()
+
+# The maximum number of column plans to keep, since every combination
+# of report options (e.g. narrow reports' attributes) has its own plan
+COLUMN_PLANS_MAX_SIZE = 256
+
+
+def invalidate_columns(schema_name=None):
+    """
+    Discards cached column plans (see ``build_columns``)
+
+    Cached plans are only reused if the schema's metadata has not changed
+    since they were planned (see ``_schema_watermark``), so this method only
+    frees the memory of plans that are known to be outdated. It is called
+    by the datastore's ``before_flush`` event handler whenever a schema,
+    attribute or choice is modified.
+
+    Parameters:
+    schema_name -- (Optional) The name of the schema whose plans will
+                   be discarded (default: if None, all plans are discarded)
+    """
+    with _column_plans_lock:
+        if schema_name is None:
+            _column_plans.clear()
+        else:
+            for key in list(_column_plans):
+                if key[0] == schema_name:
+                    _column_plans.pop(key, None)
+
+
+def _load_columns(session, plan):
+    """
+    Helper method to rebuild columns from a cached plan
+
+    Returns:
+    The columns ordered dictionary, or None if the plan is no longer valid
+    (e.g. the plan was cached from a transaction that was rolled back)
+    """
+    attribute_ids = set(i for name, ids, choice in plan for i in ids)
+
+    attributes = dict(
+        (attribute.id, attribute)
+        for attribute in (
+            session.query(models.Attribute)
+            .options(orm.subqueryload(models.Attribute.choices))
+            .filter(models.Attribute.id.in_(attribute_ids)))) \
+        if attribute_ids else {}
+
+    if len(attributes) != len(attribute_ids):
+        return None
+
+    columns = OrderedDict()
+    for name, ids, choice in plan:
+        if choice is not None:
+            attribute_id, choice_name = choice
+            choice = attributes[attribute_id].choices.get(choice_name)
+            if choice is None:
+                return None
+        columns[name] = DataColumn(
+            name, [attributes[i] for i in ids], choice)
 
     return columns
 
 
+def create_report_view(session, schema_name, view_name=None, **kw):
+    """
+    (Re)creates a database view of a schema's report
+
+    The report query is compiled once into a ``CREATE VIEW`` statement, so
+    other database clients (e.g. BI tools) can query the report directly.
+    The view has to be regenerated whenever the schema's columns change
+    (see ``refresh_report_views`` and ``events.registerReportViews``).
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    view_name -- (Optional) The name of the view
+                 (default: ``report_<schema_name>``)
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    True if the view was created, False if the schema has no published
+    versions (in which case only the existing view is dropped)
+    """
+    view_name = view_name or 'report_%s' % schema_name
+    connection = session.connection()
+    quoted = connection.dialect.identifier_preparer.quote(view_name)
+
+    published = (
+        session.query(models.Schema.id)
+        .filter(models.Schema.name == schema_name)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .first())
+
+    # Compile before dropping the existing view, so that a report that
+    # cannot be compiled leaves the existing view in place
+    if published is not None:
+        statement = _report_query(session, schema_name, **kw).statement
+        compiled = compile_literal(statement, connection.dialect)
+
+    # The compiled statement does not have any parameters (e.g. labels with
+    # colons), so execute it as is
+    connection = connection.execution_options(no_parameters=True)
+    connection.execute('DROP VIEW IF EXISTS %s' % quoted)
+
+    if published is None:
+        return False
+
+    connection.execute(
+        'CREATE VIEW %s AS %s' % (quoted, six.text_type(compiled)))
+
+    return True
+
+
+def refresh_report_views(session, schema_names=None, **kw):
+    """
+    (Re)creates the report views of the published schemata
+
+    Parameters:
+    session -- The database session to use
+    schema_names -- (Optional) The names of the schemata to refresh
+                    (default: if None, all published schemata)
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    The names of the schemata that have a report view
+    """
+    if schema_names is None:
+        schema_names = [
+            name for name, in
+            session.query(models.Schema.name)
+            .filter(models.Schema.publish_date != null())
+            .filter(models.Schema.retract_date == null())
+            .distinct()]
+
+    return [
+        schema_name for schema_name in sorted(schema_names)
+        if create_report_view(session, schema_name, **kw)]
+
+
+def materialize_report(session, schema_name, table_name=None, **kw):
+    """
+    Materializes a schema's report into a real table.
+
+    The first call creates the table with the full report. Subsequent
+    calls refresh the table incrementally: only entities that were modified
+    (or had values modified) since the last refresh are re-pivoted, and
+    rows of deleted entities are removed. The table is rebuilt from scratch
+    if the schema's metadata has changed (e.g. a new schema version
+    was published or a choice was renamed).
+
+    The refreshes are kept track of in the ``report_watermark`` table
+    (see ``models.ReportWatermark``). On vendors other than
+    PostgreSQL, modifications committed by transactions that were already
+    in progress during a refresh may be missed by later refreshes
+    (see ``_watermark_query``).
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    table_name -- (Optional) The name of the table to materialize into
+                  (default: ``<schema_name>_report``)
+    kw -- (Optional) Additional report options for ``build_report``,
+          these should be the same for every refresh
+
+    Returns:
+    The SQLAlchemy ``Table`` of the materialized report
+    """
+    table_name = table_name or '%s_report' % schema_name
+    connection = session.connection()
+
+    query = _report_query(session, schema_name, **kw)
+    report = query.subquery()
+
+    table = Table(
+        table_name,
+        MetaData(),
+        *[Column(c.name,
+                 UnicodeText() if isinstance(c.type, NullType) else c.type,
+                 primary_key=(c.name == 'id'))
+          for c in report.columns])
+
+    watermark_table = models.ReportWatermark.__table__
+
+    stored = connection.execute(
+        watermark_table.select()
+        .where(watermark_table.c.name == table_name)).first()
+
+    # Changes to the metadata can alter the rows of the report without
+    # altering its columns (e.g. a retracted version or a renamed choice)
+    schema_watermark = _schema_watermark(session, schema_name)
+
+    exists = connection.dialect.has_table(connection, table_name)
+
+    if exists and stored is not None and stored.watermark is not None:
+        watermark = stored.watermark
+        existing = [c['name']
+                    for c in inspect(connection).get_columns(table_name)]
+        rebuild = (
+            existing != [c.name for c in table.columns]
+            or schema_watermark != (stored.schema_modify_date,
+                                    stored.schema_count,
+                                    stored.schema_revision))
+    else:
+        watermark = None
+        rebuild = True
+
+    # Determine the new watermark *before* reading any entities, so that
+    # modifications during the refresh will be picked up by the next one
+    latest = connection.scalar(_watermark_query(session, schema_name))
+
+    if rebuild:
+        if exists:
+            table.drop(connection)
+        table.create(connection)
+        connection.execute(
+            table.insert().from_select(
+                [c.name for c in table.columns], query.statement))
+
+    else:
+        modified = _modified_query(session, schema_name, watermark).alias()
+        connection.execute(
+            table.delete().where(
+                table.c.id.in_(select([modified.c.id]))
+                | ~table.c.id.in_(select([models.Entity.id]))))
+        connection.execute(
+            table.insert().from_select(
+                [c.name for c in table.columns],
+                query.filter(
+                    models.Entity.id.in_(select([modified.c.id])))
+                .statement))
+
+    schema_modify_date, schema_count, schema_revision = schema_watermark
+    connection.execute(
+        watermark_table.delete()
+        .where(watermark_table.c.name == table_name))
+    connection.execute(
+        watermark_table.insert()
+        .values(name=table_name,
+                watermark=latest or watermark,
+                schema_modify_date=schema_modify_date,
+                schema_count=schema_count,
+                schema_revision=schema_revision))
+
+    return table
+
+
+def _watermark_query(session, schema_name):
+    """
+    Helper method to get the refresh watermark of a schema's data
+
+    Since ``modify_date`` is the time the modifying transaction started,
+    transactions that are still in progress may later commit modifications
+    dated before the latest modification visible now. On PostgreSQL the
+    watermark is therefore held back to the start of the oldest other
+    transaction in progress (see ``pg_stat_activity``), so those
+    modifications are picked up by the next refresh.
+
+    Returns:
+    A select of the most recent ``modify_date`` of the schema's entities
+    and their values (held back to the oldest transaction in progress)
+    """
+    queries = []
+    for Model in [models.Entity] + _value_models():
+        query = (
+            session.query(func.max(Model.modify_date).label('modify_date'))
+            .select_from(models.Entity)
+            .join(models.Schema, models.Entity.schema)
+            .filter(models.Schema.name == schema_name))
+        if Model is not models.Entity:
+            query = query.join(Model, Model.entity_id == models.Entity.id)
+        queries.append(query.statement)
+    dates = union_all(*queries).alias()
+    latest = select([func.max(dates.c.modify_date)])
+
+    if session.bind.dialect.name != 'postgresql':
+        return latest
+
+    activity = Table(
+        'pg_stat_activity',
+        MetaData(),
+        Column('pid', Integer),
+        Column('datname', String),
+        Column('xact_start', DateTime))
+    started = (
+        select([func.min(cast(activity.c.xact_start, DateTime))])
+        .where(activity.c.pid != func.pg_backend_pid())
+        .where(activity.c.datname == func.current_database())
+        .where(activity.c.xact_start != null()))
+
+    # LEAST ignores NULLs (i.e. no data or no other transactions)
+    return select([
+        func.least(latest.as_scalar(), started.as_scalar(), type_=DateTime)])
+
+
+def _data_watermark(session, schema_name):
+    """
+    Helper method to get a cheap fingerprint of a schema's data
+
+    The most recent ``modify_date`` detects new and updated data, the
+    number of rows detects deleted data and the total of the revisions
+    detects updates from transactions that started before the most recent
+    modification (``modify_date`` is the time the transaction started).
+    The schema's metadata is included as well (see ``_schema_watermark``)
+    since renaming an attribute or choice changes the report's contents.
+
+    Returns:
+    A tuple of the most recent ``modify_date``, the number of rows and the
+    total of the revisions of the schema's versions, attributes, choices,
+    entities and values
+    """
+    queries = _schema_watermark_queries(session, schema_name)
+    for Model in [models.Entity] + _value_models():
+        query = session.query(
+            func.max(Model.modify_date).label('modify_date'),
+            func.count().label('count'),
+            func.sum(Model.revision).label('revision'))
+        query = query.select_from(models.Entity).join(
+            models.Schema, models.Entity.schema)
+        if Model is not models.Entity:
+            query = query.join(Model, Model.entity_id == models.Entity.id)
+        queries.append(
+            query.filter(models.Schema.name == schema_name).statement)
+    return _watermark(session, queries)
+
+
+def _schema_watermark(session, schema_name):
+    """
+    Helper method to get a cheap fingerprint of a schema's metadata
+
+    Same as ``_data_watermark``, but for the metadata that determines the
+    report's columns (i.e. publishing, retracting or modifying a version,
+    its attributes or their choices changes the fingerprint).
+
+    Returns:
+    A tuple of the most recent ``modify_date``, the number of rows and the
+    total of the revisions of the schema's versions, attributes and choices
+    """
+    return _watermark(session, _schema_watermark_queries(session, schema_name))
+
+
+def _schema_watermark_queries(session, schema_name):
+    """
+    Helper method to list the fingerprint queries of a schema's metadata
+
+    Returns:
+    A list of statements, one per metadata table, that each select the
+    most recent ``modify_date``, the number of rows and the total of the
+    revisions of the schema's rows in that table
+    """
+    queries = []
+    for Model in (models.Schema, models.Attribute, models.Choice):
+        query = session.query(
+            func.max(Model.modify_date).label('modify_date'),
+            func.count().label('count'),
+            func.sum(Model.revision).label('revision'))
+        if Model is models.Choice:
+            query = query.join(
+                models.Attribute,
+                models.Attribute.id == models.Choice.attribute_id)
+        if Model is not models.Schema:
+            query = query.join(
+                models.Schema,
+                models.Schema.id == models.Attribute.schema_id)
+        queries.append(
+            query.filter(models.Schema.name == schema_name).statement)
+    return queries
+
+
+def _watermark(session, queries):
+    """
+    Helper method to combine fingerprint queries into a single fingerprint
+
+    Returns:
+    A tuple of the most recent ``modify_date``, the total number of rows
+    and the total of the revisions over all of the queries
+    """
+    rows = union_all(*queries).alias()
+    return tuple(session.execute(
+        select([
+            func.max(rows.c.modify_date),
+            func.sum(rows.c.count),
+            func.sum(rows.c.revision)]))
+        .first())
+
+
+def _modified_query(session, schema_name, since, until=None):
+    """
+    Helper method to list the entities of a schema that have been modified
+
+    An entity is considered modified if either the entity itself or any of
+    its values has a ``modify_date`` within the given range.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    since -- The inclusive lower bound of the modification date
+    until -- (Optional) The exclusive upper bound of the modification date
+
+    Returns:
+    A union select with an ``id`` column of the modified entity ids
+    """
+    queries = []
+    for Model in [models.Entity] + _value_models():
+        query = (
+            session.query(models.Entity.id.label('id'))
+            .join(models.Schema, models.Entity.schema)
+            .filter(models.Schema.name == schema_name))
+        if Model is not models.Entity:
+            query = query.join(Model, Model.entity_id == models.Entity.id)
+        if since is not None:
+            query = query.filter(Model.modify_date >= since)
+        if until is not None:
+            query = query.filter(Model.modify_date < until)
+        queries.append(query.statement)
+    return union(*queries)
+
+
+def _value_models():
+    """
+    Helper method to list the distinct value table models
+    """
+    return sorted(set(itervalues(models.nameModelMap)),
+                  key=lambda Model: Model.__tablename__)
+
+
+def iter_report(session, report, batch_size=1000):
+    """
+    Streams the results of a report query in bounded batches.
+
+    On PostgreSQL the rows are fetched through a server-side (named) cursor,
+    other vendors fetch the results in chunks of ``batch_size`` rows. Either
+    way, at most one batch is held in memory at any given time.
+
+    Parameters:
+    session -- The database session to use
+    report -- A report query generated by ``build_report``
+    batch_size -- (Optional) The maximum number of rows per batch
+
+    Returns:
+    A generator of row lists, each containing at most ``batch_size`` rows
+    ordered by entity id.
+    """
+    query = (
+        session.query(report)
+        .order_by(report.c.id)
+        .yield_per(batch_size))
+
+    batch = []
+    for row in query:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def build_report_arrays(session, schema_name, batch_size=1000, **kw):
+    """
+    Loads a report into typed column arrays (requires NumPy)
+
+    The report is streamed in batches (see ``iter_report``), each batch is
+    converted to arrays so that only the arrays are held in memory.
+
+    The columns are typed as follows:
+    * integers -- ``int64`` arrays
+    * numbers -- ``float64`` arrays
+    * dates -- ``datetime64[D]`` arrays
+    * datetimes -- ``datetime64[us]`` arrays
+    * choices -- ``int32`` category codes (indexes into the column's
+                 categories), the choice ids are reported by the database
+                 and decoded client-side
+    * everything else (text, collections, private) -- object arrays
+
+    All typed arrays are masked arrays where missing values are masked.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    batch_size -- (Optional) The maximum number of rows to convert at a time
+    kw -- (Optional) Additional report options for ``build_report``
+
+    Returns:
+    A ``ReportArrays`` of the report
+    """
+    if numpy is None:
+        raise ImportError('NumPy is required to build report arrays')
+
+    kw['use_choice_ids'] = True
+    use_choice_labels = kw.get('use_choice_labels', False)
+    ignore_private = kw.get('ignore_private', True)
+
+    columns = build_columns(
+        session,
+        schema_name,
+        kw.get('ids'),
+        kw.get('expand_collections', False),
+        attributes=kw.get('attributes'))
+    report = build_report(session, schema_name, **kw)
+
+    result = ReportArrays()
+    converters = []
+
+    for report_column in report.columns:
+        name = report_column.name
+        column = columns.get(name)
+        if column is not None and column.is_private and ignore_private:
+            converters.append(_object_array)
+        elif column is not None and column.choice is not None:
+            if use_choice_labels:
+                converters.append(_object_array)
+            else:
+                converters.append(_typed_array('int8', 0))
+        elif column is not None and column.type == 'choice':
+            if column.is_collection:
+                converters.append(_collection_array(column, use_choice_labels))
+            else:
+                codes = sorted(set(
+                    code for code, label in itervalues(column.choice_ids)))
+                result.categories[name] = OrderedDict(
+                    (code, column.choices[code]) for code in codes)
+                converters.append(_category_array(column, codes))
+        elif isinstance(report_column.type, (Boolean, Integer)):
+            converters.append(_typed_array('int64', 0))
+        elif isinstance(report_column.type, Numeric):
+            converters.append(_typed_array('float64', 0))
+        elif isinstance(report_column.type, DateTime):
+            converters.append(_typed_array('datetime64[us]', 'NaT'))
+        elif isinstance(report_column.type, Date):
+            converters.append(_typed_array('datetime64[D]', 'NaT'))
+        else:
+            converters.append(_object_array)
+
+    chunks = [[] for converter in converters]
+    for batch in iter_report(session, report, batch_size):
+        for i, values in enumerate(zip(*batch)):
+            chunks[i].append(converters[i](values))
+
+    for i, report_column in enumerate(report.columns):
+        if chunks[i]:
+            array = numpy.ma.concatenate(chunks[i])
+        else:
+            array = converters[i](())
+        result.arrays[report_column.name] = array
+
+    return result
+
+
+def _typed_array(dtype, missing):
+    """
+    Helper method to generate a masked array converter
+    """
+    def convert(values):
+        mask = numpy.array([v is None for v in values], dtype=bool)
+        data = numpy.array(
+            [missing if v is None else v for v in values], dtype=dtype)
+        return numpy.ma.MaskedArray(data, mask=mask)
+    return convert
+
+
+def _object_array(values):
+    """
+    Helper method to convert values to an object array
+    """
+    array = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value  # assigned one by one so lists are not unpacked
+    return numpy.ma.MaskedArray(array, mask=False)
+
+
+def _category_array(column, codes):
+    """
+    Helper method to generate a choice id to category code converter
+    """
+    indexes = dict(
+        (choice_id, codes.index(code))
+        for choice_id, (code, label) in iteritems(column.choice_ids))
+    convert = _typed_array('int32', -1)
+    return lambda values: convert([
+        None if v is None else indexes[v] for v in values])
+
+
+def _collection_array(column, use_choice_labels):
+    """
+    Helper method to generate a delimited choice ids converter
+    """
+    def convert(values):
+        rows = [KeyedTuple([v], [column.name]) for v in values]
+        columns = {column.name: column}
+        decoded = decode_choices(columns, rows, use_choice_labels)
+        return _object_array([row[0] for row in decoded])
+    return convert
+
+
+def decode_choices(columns,
+                   rows,
+                   use_choice_labels=False,
+                   ignore_private=True):
+    """
+    Decodes the choice ids of a report built with ``use_choice_ids``
+
+    The codes (or labels) are looked up from the already loaded columns,
+    so the report itself does not need to join the choice table.
+
+    Parameters:
+    columns -- The columns of the report (see ``build_columns``)
+    rows -- The rows of the report (e.g. a batch from ``iter_report``)
+    use_choice_labels -- (Optional) Decodes to choice labels instead of codes
+                         (default is False)
+    ignore_private -- (Optional) Whether the report was built ignoring
+                      private columns (default is True)
+
+    Returns:
+    A generator of the decoded rows
+    """
+    positions = None
+
+    for row in rows:
+        if positions is None:
+            labels = list(row.keys())
+            positions = [
+                (i, columns[name])
+                for i, name in enumerate(labels)
+                if name in columns
+                and columns[name].type == 'choice'
+                and columns[name].choice is None
+                and not (columns[name].is_private and ignore_private)]
+
+        values = list(row)
+        for i, column in positions:
+            value = values[i]
+            if value is None:
+                continue
+            index = 1 if use_choice_labels else 0
+            if column.is_collection and isinstance(value, list):
+                values[i] = [
+                    column.choice_ids[choice_id][index]
+                    for choice_id in value]
+            elif column.is_collection:
+                values[i] = u';'.join(
+                    column.choice_ids[int(choice_id)][index]
+                    for choice_id in value.split(';'))
+            else:
+                values[i] = column.choice_ids[value][index]
+
+        yield KeyedTuple(values, labels)
+
+
+def iter_pivot_report(session,
+                      schema_name,
+                      ids=None,
+                      attributes=None,
+                      expand_collections=False,
+                      use_choice_labels=False,
+                      context=None,
+                      ignore_private=True,
+                      batch_size=1000,
+                      filters=None):
+    """
+    Streams a report by merge-pivoting the value tables in Python.
+
+    Instead of joining one value table alias per column, each value table
+    is scanned once (ordered by entity) and merged into the entity stream.
+    The cost therefore grows with the number of values rather than the
+    number of columns, which makes this engine suitable for very wide
+    schemata that would otherwise exceed vendor join limits.
+
+    Parameters are the same as ``build_report``, with the addition of:
+    batch_size -- (Optional) The maximum number of rows per batch
+
+    Returns:
+    A generator of row lists (see ``iter_report``). The rows have the
+    same columns as the ``build_report`` query.
+    """
+    columns = list(itervalues(build_columns(
+        session, schema_name, ids, expand_collections,
+        attributes=attributes)))
+
+    entities = _entity_query(session, schema_name, ids, context)
+    if filters:
+        entities = _add_filters(
+            session, entities, schema_name, ids, filters, ignore_private)
+    entities = _add_audit_columns(entities)
+    names = [d['name'] for d in entities.column_descriptions]
+    split = len(names) - 4  # data columns go before the audit columns
+    labels = names[:split] + [c.name for c in columns] + names[split:]
+
+    # Map each attribute to the report positions its values populate
+    targets = {}
+    for i, column in enumerate(columns):
+        if column.is_private and ignore_private:
+            continue
+        for attribute in column.attributes:
+            targets.setdefault(attribute.id, []).append((i, column))
+
+    streams = []
+    for Value in _value_models():
+        attribute_ids = sorted(set(
+            a.id
+            for c in columns
+            for a in c.attributes
+            if a.id in targets and models.nameModelMap[c.type] is Value))
+        if not attribute_ids:
+            continue
+        query = (
+            session.query(Value.entity_id, Value.attribute_id, Value._value)
+            .filter(Value.attribute_id.in_(attribute_ids))
+            .order_by(Value.entity_id, Value.id))
+        streams.append(iter(query.yield_per(batch_size)))
+
+    def pivot(entity, values):
+        data = [None] * len(columns)
+        for i, column in enumerate(columns):
+            if column.is_private and ignore_private:
+                data[i] = u'[PRIVATE]'
+        for value in values:
+            for i, column in targets[value[1]]:
+                if column.type == 'choice':
+                    # Decoded from the loaded choices instead of a join
+                    code, label = column.choice_ids[value[2]]
+                    if column.is_collection and expand_collections:
+                        if code == column.choice.name:
+                            data[i] = label if use_choice_labels else 1
+                        elif data[i] is None and not use_choice_labels:
+                            data[i] = 0
+                        continue
+                    converted = label if use_choice_labels else code
+                else:
+                    converted = _convert_value(column, value[2])
+                if column.is_collection and data[i] is not None:
+                    data[i] += u';' + six.text_type(converted)
+                else:
+                    data[i] = converted
+        row = tuple(entity)
+        return KeyedTuple(row[:split] + tuple(data) + row[split:], labels)
+
+    batch = []
+    for entity, values in _merge_values(
+            entities.order_by(models.Entity.id).yield_per(batch_size),
+            streams):
+        batch.append(pivot(entity, values))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _merge_values(entities, streams):
+    """
+    Helper method to merge entity-ordered value streams into the entities
+
+    Parameters:
+    entities -- an iterable of entity rows ordered by id
+    streams -- iterators of ``(entity_id, ...)`` rows ordered by entity_id
+
+    Returns:
+    A generator of ``(entity, values)`` pairs
+    """
+    heads = [next(stream, None) for stream in streams]
+    for entity in entities:
+        values = []
+        for i, stream in enumerate(streams):
+            head = heads[i]
+            # Skip values of entities not in the report (e.g. context)
+            while head is not None and head[0] < entity.id:
+                head = next(stream, None)
+            while head is not None and head[0] == entity.id:
+                values.append(head)
+                head = next(stream, None)
+            heads[i] = head
+        yield entity, values
+
+
+def _convert_value(column, value):
+    """
+    Helper method to cast a raw value the same way the report query does
+    """
+    if value is None:
+        return None
+    if column.type == 'date' and isinstance(value, datetime):
+        return value.date()
+    if column.type == 'blob':
+        return u'[FILE]'
+    return value
+
+
+class ReportProfile(object):
+    """
+    Instrumentation results of a report (see ``profile_report``)
+
+    All times are in seconds, attributes that were not measured are None.
+    """
+
+    def __init__(self):
+        self.plan_time = None  # Time spent in ``build_columns``
+        self.build_time = None  # Time spent in ``build_report`` (inclusive)
+        self.compile_time = None  # Time spent compiling the SQL
+        self.execute_time = None  # Time spent executing and fetching
+        self.row_count = None
+        self.sql = None
+        self.explain = None  # Rows of the vendor's EXPLAIN output
+
+    def to_json(self):
+        """
+        Serializes to a JSON-ready dictionary
+        """
+        return {
+            'plan_time': self.plan_time,
+            'build_time': self.build_time,
+            'compile_time': self.compile_time,
+            'execute_time': self.execute_time,
+            'row_count': self.row_count,
+            'sql': self.sql,
+            'explain': self.explain}
+
+
+class ReportCache(object):
+    """
+    A least-recently-used cache of report results
+
+    Results are keyed by the schema name and report options, and are only
+    reused while the schema's data watermark (the most recent modification
+    date, the number of rows and the total of the revisions of the schema's
+    metadata, entities and values) has not changed. Checking the watermark
+    is much cheaper than generating the report.
+
+    The cache can be shared between threads. Results kept on disk are
+    picked up again by later caches using the same directory.
+
+    Note that the watermark does not detect modifications that bypass the
+    datastore models (e.g. restoring a backup).
+    """
+
+    def __init__(self, max_size=32, directory=None):
+        """
+        Parameters:
+        max_size -- (Optional) The maximum number of results to keep
+        directory -- (Optional) A directory to keep the results in
+                     (default: if None, results are kept in memory)
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None and os.path.isdir(directory):
+            self._index()
+
+    def get(self, session, schema_name, **kw):
+        """
+        Fetches the rows of a report, generating them only if necessary
+
+        Parameters:
+        session -- The database session to use
+        schema_name -- The name of the schema
+        kw -- (Optional) Additional report options for ``build_report``
+
+        Returns:
+        A list of the report's rows ordered by entity id
+        """
+        key = self._key(schema_name, kw)
+        watermark = _data_watermark(session, schema_name)
+
+        entry = self._load(key)
+        if entry is not None and entry[0] == watermark:
+            labels, rows = entry[1]
+            return [KeyedTuple(row, labels) for row in rows]
+
+        report = build_report(session, schema_name, **kw)
+        result = session.query(report).order_by(report.c.id).all()
+        labels = [c.name for c in report.columns]
+        self._store(key, (watermark, (labels, [tuple(r) for r in result])))
+        return result
+
+    def clear(self):
+        """
+        Discards all cached results
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._discard(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, schema_name, kw):
+        """
+        Helper method to hash the schema name and report options
+        """
+        options = json.dumps(kw, sort_keys=True, default=repr)
+        return hashlib.sha1(
+            (u'%s:%s' % (schema_name, options)).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        """
+        Helper method to get the file of a result kept on disk
+        """
+        return os.path.join(self.directory, '%s.report' % key)
+
+    def _index(self):
+        """
+        Helper method to pick up the results kept in the directory,
+        in order of their last use
+        """
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith('.report')]
+        for path in sorted(paths, key=os.path.getmtime):
+            key = os.path.basename(path)[:-len('.report')]
+            self._entries[key] = True
+        while len(self._entries) > self.max_size:
+            self._discard(next(iter(self._entries)))
+
+    def _load(self, key):
+        """
+        Helper method to look up an entry and mark it as recently used
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if self.directory is not None:
+                try:
+                    with open(self._path(key), 'rb') as fp:
+                        entry = pickle.load(fp)
+                except (IOError, OSError):
+                    entry = None
+                else:
+                    # Keep track of the last use for later caches
+                    os.utime(self._path(key), None)
+            if entry is not None:
+                # Re-insert as the most recently used
+                self._entries[key] = entry if self.directory is None else True
+            return entry
+
+    def _store(self, key, entry):
+        """
+        Helper method to add an entry, evicting the least recently used
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            if self.directory is None:
+                self._entries[key] = entry
+            else:
+                with open(self._path(key), 'wb') as fp:
+                    pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+                self._entries[key] = True
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        """
+        Helper method to remove an entry (the lock should be held)
+        """
+        del self._entries[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+
+class ReportArrays(object):
+    """
+    The columns of a report as arrays (see ``build_report_arrays``)
+    """
+
+    def __init__(self):
+        # The arrays of each report column, in report order
+        self.arrays = OrderedDict()
+        # The ordered codes and labels of each choice column's categories
+        self.categories = OrderedDict()
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __len__(self):
+        return len(next(itervalues(self.arrays))) if self.arrays else 0
+
+
 class DataColumn(object):
     """
     A data dictionary column for reference when inspecting a report column.
@@ -298,3 +1952,7 @@ class DataColumn(object):
             self.choices = dict((c.name, c.title)
                                 for a in attributes
                                 for c in itervalues(a.choices))
+        # The codes and labels of each choice id (see ``decode_choices``)
+        self.choice_ids = dict((c.id, (c.name, c.title))
+                               for a in attributes
+                               for c in itervalues(a.choices))
@@ -2,13 +2,15 @@
 Cross-vendor compatibility functions
 """
 
+from datetime import date, datetime
 import json
 
 from sqlalchemy import func, collate
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import FunctionElement
-from sqlalchemy.types import TypeDecorator, TEXT, VARCHAR
+from sqlalchemy.types import \
+    TypeDecorator, Date, DateTime, TEXT, UnicodeText, VARCHAR
 
 
 class group_concat(FunctionElement):
@@ -19,12 +21,13 @@ class group_concat(FunctionElement):
     delimiter -- (Optional in sqlite) The delimiter to use
     """
     name = 'group_concat'
+    type = UnicodeText()
 
 
 @compiles(group_concat)
 @compiles(group_concat, 'sqlite')
 def group_concat_sqlite(element, compiler, **kw):
-    compiled = tuple(map(compiler.process, element.clauses))
+    compiled = tuple(compiler.process(c, **kw) for c in element.clauses)
     if len(compiled) == 2:
         return 'GROUP_CONCAT(%s, %s)' % compiled
     elif len(compiled) == 1:
@@ -35,13 +38,22 @@ def group_concat_sqlite(element, compiler, **kw):
 
 @compiles(group_concat, 'postgresql')
 def group_concat_pg(element, compiler, **kw):
-    compiled = tuple(map(compiler.process, element.clauses))
+    compiled = tuple(compiler.process(c, **kw) for c in element.clauses)
     if len(compiled) == 2:
         return 'ARRAY_TO_STRING(ARRAY_AGG(%s), %s)' % compiled
     else:
         raise TypeError('Only 2 arguments supported in PostgreSQL')
 
 
+@compiles(group_concat, 'duckdb')
+def group_concat_duckdb(element, compiler, **kw):
+    compiled = tuple(compiler.process(c, **kw) for c in element.clauses)
+    if len(compiled) == 2:
+        return 'STRING_AGG(%s, %s)' % compiled
+    else:
+        raise TypeError('Only 2 arguments supported in DuckDB')
+
+
 class to_date(FunctionElement):
     """
     Generates a date converted value
@@ -49,17 +61,19 @@ class to_date(FunctionElement):
     expression -- The source subquery
     """
     name = 'to_date'
+    type = Date()
 
 
 @compiles(to_date, 'sqlite')
 def to_date_sqlite(element, compiler, **kw):
-    return 'DATE(%s)' % compiler.process(element.clauses)
+    return 'DATE(%s)' % compiler.process(element.clauses, **kw)
 
 
 @compiles(to_date)
 @compiles(to_date, 'postgresql')
+@compiles(to_date, 'duckdb')
 def to_date_pg(element, compiler, **kw):
-    return 'CAST(%s AS DATE)' % compiler.process(element.clauses)
+    return 'CAST(%s AS DATE)' % compiler.process(element.clauses, **kw)
 
 
 class to_datetime(FunctionElement):
@@ -69,17 +83,19 @@ class to_datetime(FunctionElement):
     expression -- The source subquery
     """
     name = 'to_date'
+    type = DateTime()
 
 
 @compiles(to_datetime, 'sqlite')
 def to_datetime_sqlite(element, compiler, **kw):
-    return 'DATETIME(%s)' % compiler.process(element.clauses)
+    return 'DATETIME(%s)' % compiler.process(element.clauses, **kw)
 
 
 @compiles(to_datetime)
 @compiles(to_datetime, 'postgresql')
+@compiles(to_datetime, 'duckdb')
 def to_datetime_pg(element, compiler, **kw):
-    return 'CAST(%s AS TIMESTAMP)' % compiler.process(element.clauses)
+    return 'CAST(%s AS TIMESTAMP)' % compiler.process(element.clauses, **kw)
 
 
 class JSON(TypeDecorator):
@@ -89,7 +105,7 @@ class JSON(TypeDecorator):
     To make this type mutable, use the ``sqlalchemy.ext.mutable``.
 
     Uses PostgreSQL's native JSON types, otherwise falls back to
-    a regulart TEXT field with the encoded JSON object.
+    a regulart TEXT field with the encoded JSON object (e.g. SQLite, DuckDB).
     """
 
     impl = TEXT
@@ -132,6 +148,41 @@ def case_insensitive_sqlite(element, compiler, **kw):
 
 
 @compiles(CaseInsensitive, 'postgresql')
+@compiles(CaseInsensitive, 'duckdb')
 def case_insensitive_postgresql(element, compiler, **kw):
     arg1, = list(element.clauses)
     return compiler.process(func.lower(arg1), **kw)
+
+
+def compile_literal(statement, dialect):
+    """
+    Compiles a statement with its parameters rendered inline
+
+    SQLAlchemy's ``literal_binds`` cannot render date and time values,
+    so these are rendered as ISO 8601 typed literals (plain strings in
+    SQLite, which stores dates as text).
+
+    Parameters:
+    statement -- The statement to compile
+    dialect -- The dialect to compile for
+
+    Returns:
+    The compiled statement, without any parameters
+    """
+
+    class LiteralCompiler(dialect.statement_compiler):
+
+        def render_literal_value(self, value, type_):
+            if isinstance(value, datetime):
+                type_name, value = 'TIMESTAMP', value.isoformat(' ')
+            elif isinstance(value, date):
+                type_name, value = 'DATE', value.isoformat()
+            else:
+                return super(LiteralCompiler, self).render_literal_value(
+                    value, type_)
+            if dialect.name == 'sqlite':
+                return "'%s'" % value
+            return "%s '%s'" % (type_name, value)
+
+    return LiteralCompiler(
+        dialect, statement, compile_kwargs={'literal_binds': True})
@@ -0,0 +1,31 @@
+"""Add report watermark
+
+Keeps track of the refreshes of materialized reports.
+
+Revision ID: 9c2e71d4a0b3
+Revises: 5eb8bce63d7e
+Create Date: 2026-10-18 10:12:41.508326
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c2e71d4a0b3'
+down_revision = '5eb8bce63d7e'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'report_watermark',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('watermark', sa.DateTime()),
+        sa.Column('schema_modify_date', sa.DateTime()),
+        sa.Column('schema_count', sa.Integer()),
+        sa.Column('schema_revision', sa.Integer()))
+
+
+def downgrade():
+    op.drop_table('report_watermark')
@@ -13,6 +13,9 @@ REQUIRES = [
 ]
 
 EXTRAS = {
+    'duckdb': ['duckdb'],
+    'numpy': ['numpy'],
+    'parquet': ['pyarrow'],
     'postgresql': ['psycopg2'],
     'test': ['pytest', 'pytest-cov'],
 }
@@ -74,7 +77,7 @@ setup(
     author_email='younglabs@ucsd.edu',
     url='https://github.com/younglabs/occams_datatore',
     license='BSD',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     zip_safe=False,
     install_requires=REQUIRES,
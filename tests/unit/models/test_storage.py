@@ -182,8 +182,7 @@ def check_entity_types(db_session, type, simple, update, collection):
     assert set(collection[:2]) == set(entity[collectionName])
     assert 2 == valueQuery.count()
 
-    # Lists are not audited, they're just removed and a new one is
-    # set
+    # Values that are still in the list are left untouched
     assert sorted([1, 1]) == sorted([v.revision for v in valueQuery])
 
 
@@ -217,6 +216,168 @@ def test_entity_force_date(db_session):
     assert today == entity[simpleName]
 
 
+def test_entity_values_by_attribute_id(db_session):
+    """
+    It should group values by attribute id without loading their attributes
+    """
+    from datetime import date
+    from sqlalchemy import inspect
+    from occams_datastore import models
+
+    schema = models.Schema(name=u'Foo', title=u'',
+                           publish_date=date(2000, 1, 1))
+    s1 = models.Attribute(
+        schema=schema, name='s1', title=u'Section 1', type='section', order=0)
+    schema.attributes['a'] = models.Attribute(
+        schema=schema, parent_attribute=s1,
+        name=u'a', title=u'', type='string', order=1)
+    entity = models.Entity(schema=schema)
+    db_session.add(entity)
+
+    # Values of unflushed attributes are re-grouped once flushed
+    entity['a'] = u'foo'
+    db_session.flush()
+    entity['a'] = u'bar'
+    db_session.flush()
+    assert 1 == db_session.query(models.ValueString).count()
+    entity_id = entity.id
+
+    db_session.expunge_all()
+    entity = db_session.query(models.Entity).get(entity_id)
+    assert u'bar' == entity['a']
+    value = db_session.query(models.ValueString).one()
+    assert 'attribute' in inspect(value).unloaded
+
+
+def test_grouped_collection():
+    """
+    It should group values and remove them without reordering groups
+    """
+    from occams_datastore.models.storage import GroupedCollection
+
+    class Value(object):
+        def __init__(self, key):
+            self.key = key
+
+    values = [Value('a'), Value('a'), Value('a'), Value('b')]
+    collection = GroupedCollection(lambda v: v.key)
+    for value in values:
+        collection[value.key] = value
+
+    assert 3 == len(collection['a'])
+    assert 0 == len(collection['c'])
+
+    collection._remove(values[0])
+    assert values[1:3] == list(collection['a'])
+    assert values[1] == collection['a'][0]
+    assert values[0] not in collection['a']
+
+    collection.rekey('a', 'c')
+    assert 0 == len(collection['a'])
+    assert values[1:3] == list(collection['c'])
+
+    del collection['c']
+    assert [values[3]] == list(collection._iterator())
+
+
+def test_entity_update_collection(db_session):
+    """
+    It should only add or remove the values of a collection that changed
+    """
+    from datetime import date
+    from occams_datastore import models
+
+    schema = models.Schema(
+        name=u'Foo', title=u'',
+        publish_date=date(2000, 1, 1),
+        attributes={
+            's1': models.Attribute(
+                name=u's1', title=u'Section 1', type='section', order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1,
+                        is_collection=True)})})
+    entity = models.Entity(schema=schema)
+    db_session.add(entity)
+    entity['a'] = [u'foo', u'bar', u'baz']
+    db_session.flush()
+
+    def values():
+        query = db_session.query(models.ValueString)
+        return dict((v.value, v.id) for v in query)
+
+    before = values()
+    entity['a'] = [u'bar', u'baz', u'caz']
+    db_session.flush()
+    after = values()
+
+    assert [u'bar', u'baz', u'caz'] == entity['a']
+    assert before[u'bar'] == after[u'bar']
+    assert before[u'baz'] == after[u'baz']
+    assert u'foo' not in after
+
+
+def test_entity_update_to_dict(db_session):
+    """
+    It should set and get all the values of an entity at once
+    """
+    from datetime import date
+    from decimal import Decimal
+    from occams_datastore import models
+
+    schema = models.Schema(
+        name=u'Foo', title=u'',
+        publish_date=date(2000, 1, 1),
+        attributes={
+            's1': models.Attribute(
+                name=u's1', title=u'Section 1', type='section', order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1),
+                    'b': models.Attribute(
+                        name=u'b', title=u'', type='date', order=2),
+                    'c': models.Attribute(
+                        name=u'c', title=u'', type='number', order=3),
+                    'd': models.Attribute(
+                        name=u'd', title=u'', type='choice', order=4,
+                        is_collection=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=1),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=2)}),
+                    'f': models.Attribute(
+                        name=u'f', title=u'', type='choice', order=5,
+                        is_collection=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=1)})})})
+    entity = models.Entity(schema=schema)
+    db_session.add(entity)
+
+    entity.update({
+        'a': u'foo',
+        'b': date(2010, 1, 1),
+        'd': [u'001', u'002']})
+    db_session.flush()
+    entity.update({'c': Decimal('1.5'), 'd': [u'002']})
+    db_session.flush()
+    entity_id = entity.id
+
+    db_session.expunge_all()
+    entity = db_session.query(models.Entity).get(entity_id)
+    data = entity.to_dict()
+
+    assert {
+        'a': u'foo',
+        'b': date(2010, 1, 1),
+        'c': Decimal('1.5'),
+        'd': [u'002'],
+        'f': [],
+    } == data
+    assert dict((k, entity[k]) for k in data) == data
+
+
 def test_entity_choices(db_session):
     """
     It should properly handle choices
@@ -311,6 +472,72 @@ def test_entity_blob_type(db_session):
     assert blob is None
 
 
+def test_load_entity_values(db_session):
+    """
+    It should preload the values of several entities without lazy-loading
+    """
+    from datetime import date
+    from sqlalchemy import event
+    from occams_datastore import models
+
+    schema = models.Schema(
+        name=u'Foo', title=u'',
+        publish_date=date(2000, 1, 1),
+        attributes={
+            's1': models.Attribute(
+                name=u's1', title=u'Section 1', type='section', order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1),
+                    'b': models.Attribute(
+                        name=u'b', title=u'', type='date', order=2),
+                    'c': models.Attribute(
+                        name=u'c', title=u'', type='choice', order=3,
+                        is_collection=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=1),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=2)})})})
+    db_session.add(schema)
+    for i in range(3):
+        entity = models.Entity(schema=schema)
+        entity['a'] = u'foo%d' % i
+        entity['b'] = date(2010, 1, i + 1)
+        entity['c'] = [u'001', u'002'][:i]
+        db_session.add(entity)
+    db_session.flush()
+    ids = [e.id for e in db_session.query(models.Entity)]
+    db_session.expunge_all()
+
+    # Make sure the schema metadata is already in the identity map
+    schema = db_session.query(models.Schema).one()
+    for attribute in schema.attributes.values():
+        list(attribute.choices.values())
+
+    entities = models.load_entity_values(db_session, list(reversed(ids)))
+    assert list(reversed(ids)) == [e.id for e in entities]
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db_session.bind
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        values = [(e['a'], e['b'], sorted(e['c'])) for e in entities]
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    assert [] == statements
+    assert [
+        (u'foo2', date(2010, 1, 3), [u'001', u'002']),
+        (u'foo1', date(2010, 1, 2), [u'001']),
+        (u'foo0', date(2010, 1, 1), []),
+    ] == values
+
+
 @pytest.mark.parametrize('type_,limit,below,equal,over', [
     ('string', 5, u'foo', u'foooo', u'foobario'),
     ('number', 5, Decimal('2.0'), Decimal('5.0'), Decimal('10.0')),
@@ -0,0 +1,107 @@
+"""
+Tests the DuckDB analytical reports
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize('expand_collections,use_choice_labels,dates', [
+    (False, False, False),
+    (True, True, False),
+    (False, False, True),
+])
+def test_duckdb_report(
+        db_session, tmpdir, expand_collections, use_choice_labels, dates):
+    """
+    It should generate the same report from a DuckDB replica
+    """
+    pytest.importorskip('duckdb')
+    from datetime import date, datetime
+    from decimal import Decimal
+    from occams_datastore import models, reporting, analytics
+
+    def choices():
+        return {
+            '001': models.Choice(name=u'001', title=u'Green', order=0),
+            '002': models.Choice(name=u'002', title=u'Red', order=1)}
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    's_a': models.Attribute(
+                        name=u's_a', title=u'', type='string', order=1),
+                    'n_b': models.Attribute(
+                        name=u'n_b', title=u'', type='number', order=2),
+                    'd_c': models.Attribute(
+                        name=u'd_c', title=u'', type='date', order=3),
+                    'dt_d': models.Attribute(
+                        name=u'dt_d', title=u'', type='datetime', order=4),
+                    'ch_e': models.Attribute(
+                        name=u'ch_e', title=u'', type='choice', order=5,
+                        choices=choices()),
+                    'ch_f': models.Attribute(
+                        name=u'ch_f', title=u'', type='choice', order=6,
+                        is_collection=True, choices=choices())})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['s_a'] = u'caf\xe9'
+    entity1['n_b'] = Decimal('1.5')
+    entity1['d_c'] = date(2010, 1, 1)
+    entity1['dt_d'] = datetime(2010, 1, 1, 5, 30)
+    entity1['ch_e'] = u'002'
+    entity1['ch_f'] = [u'001', u'002']
+    entity2 = models.Entity(schema=schema1)
+    db_session.add_all([entity1, entity2])
+    db_session.flush()
+
+    options = dict(expand_collections=expand_collections,
+                   use_choice_labels=use_choice_labels)
+    if dates:
+        # Date and time options are rendered as literals
+        options.update(
+            filters={'d_c': ('>=', date(2000, 1, 1))},
+            modified_since=datetime(2000, 1, 1, 12, 30))
+
+    database = analytics.connect(str(tmpdir.join('replica.duckdb')))
+    try:
+        counts = analytics.replicate(db_session, database, batch_size=1)
+        result = analytics.duckdb_report(
+            db_session, database, u'A', **options)
+    finally:
+        database.close()
+
+    assert 2 == counts['entity']
+    assert 'entity_audit' not in counts
+
+    report = reporting.build_report(db_session, u'A', **options)
+    expected = db_session.query(report).order_by(report.c.id).all()
+
+    assert (1 if dates else 2) == len(expected)
+    assert len(expected) == len(result)
+    for expected_row, result_row in zip(expected, result):
+        assert expected_row.keys() == result_row.keys()
+        for key in expected_row.keys():
+            expected_value = getattr(expected_row, key)
+            result_value = getattr(result_row, key)
+            if isinstance(expected_value, Decimal):
+                expected_value = float(expected_value)
+            if isinstance(expected_value, datetime):
+                # DuckDB timestamps have millisecond precision
+                expected_value = expected_value.replace(
+                    microsecond=expected_value.microsecond // 1000 * 1000)
+            if key == 'ch_f':
+                expected_value = expected_value and \
+                    sorted(expected_value.split(';'))
+                result_value = result_value and \
+                    sorted(result_value.split(';'))
+            assert expected_value == result_value, key
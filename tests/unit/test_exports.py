@@ -0,0 +1,328 @@
+"""
+Tests the report file writers
+"""
+
+import json
+
+import pytest
+
+
+def _make_schema(db_session):
+    from datetime import date
+    from occams_datastore import models
+
+    schema = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='string',
+                        order=1),
+                    'b': models.Attribute(
+                        name=u'b',
+                        title=u'',
+                        type='date',
+                        order=2)})})
+    db_session.add(schema)
+    db_session.flush()
+    return schema
+
+
+def test_write_csv(db_session):
+    """
+    It should write a header and one line per entity
+    """
+    import csv
+    from datetime import date
+    from six import StringIO
+    from occams_datastore import models, exports
+
+    schema = _make_schema(db_session)
+    for i in range(3):
+        entity = models.Entity(schema=schema)
+        entity['a'] = u'foo%d' % i
+        entity['b'] = date(2010, 1, i + 1)
+        db_session.add(entity)
+    db_session.flush()
+
+    fp = StringIO()
+    count = exports.write_csv(db_session, u'A', fp, batch_size=2)
+    fp.seek(0)
+    rows = list(csv.DictReader(fp))
+
+    assert count == 3
+    assert [u'foo0', u'foo1', u'foo2'] == [r['a'] for r in rows]
+    assert '2010-01-01' == rows[0]['b']
+
+
+def test_write_csv_empty(db_session):
+    """
+    It should still write the header if there are no entities
+    """
+    from six import StringIO
+    from occams_datastore import exports
+
+    _make_schema(db_session)
+
+    fp = StringIO()
+    count = exports.write_csv(db_session, u'A', fp)
+
+    assert count == 0
+    header = fp.getvalue().strip().split(',')
+    assert 'id' in header
+    assert 'a' in header
+
+
+def test_write_jsonl(db_session):
+    """
+    It should write one JSON object per line
+    """
+    from datetime import date
+    from six import StringIO
+    from occams_datastore import models, exports
+
+    schema = _make_schema(db_session)
+    entity = models.Entity(schema=schema)
+    entity['a'] = u'foo'
+    entity['b'] = date(2010, 1, 1)
+    db_session.add(entity)
+    db_session.flush()
+
+    fp = StringIO()
+    count = exports.write_jsonl(db_session, u'A', fp)
+    lines = fp.getvalue().splitlines()
+
+    assert count == 1
+    assert len(lines) == 1
+    data = json.loads(lines[0])
+    assert data['id'] == entity.id
+    assert data['a'] == u'foo'
+    assert data['b'] == '2010-01-01'
+
+
+def _make_columnar_schema(db_session):
+    from datetime import date, datetime
+    from decimal import Decimal
+    from occams_datastore import models
+
+    schema = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'n_a': models.Attribute(
+                        name=u'n_a', title=u'', type='number', order=1),
+                    'dt_b': models.Attribute(
+                        name=u'dt_b', title=u'', type='datetime', order=2),
+                    'ch_c': models.Attribute(
+                        name=u'ch_c', title=u'', type='choice', order=3,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1)}),
+                    'ch_d': models.Attribute(
+                        name=u'ch_d', title=u'', type='choice', order=4,
+                        is_collection=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1)}),
+                    'pr_e': models.Attribute(
+                        name=u'pr_e', title=u'', type='choice', order=5,
+                        is_private=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0)})})})
+    db_session.add(schema)
+    db_session.flush()
+
+    for i in range(3):
+        entity = models.Entity(schema=schema)
+        entity['n_a'] = Decimal('1.5') * i
+        entity['dt_b'] = datetime(2010, 1, i + 1, 5, 30)
+        entity['ch_c'] = [u'001', u'002', None][i]
+        entity['ch_d'] = [[u'001', u'002'], [u'002'], []][i]
+        entity['pr_e'] = u'001'
+        db_session.add(entity)
+    db_session.flush()
+
+
+@pytest.mark.parametrize('private', ['drop', 'mask'])
+def test_write_parquet(db_session, tmpdir, private):
+    """
+    It should write a typed Parquet file in row groups
+    """
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+    from datetime import datetime
+    from occams_datastore import exports
+
+    _make_columnar_schema(db_session)
+
+    path = str(tmpdir.join('A.parquet'))
+    count = exports.write_parquet(
+        db_session, u'A', path, batch_size=2, private=private)
+    assert 3 == count
+
+    parquet = pyarrow.parquet.ParquetFile(path)
+    assert 2 == parquet.num_row_groups
+
+    table = parquet.read()
+    assert pyarrow.float64() == table.schema.field_by_name('n_a').type
+    assert [0.0, 1.5, 3.0] == table.column('n_a').to_pylist()
+    assert pyarrow.timestamp('us') == table.schema.field_by_name('dt_b').type
+    assert datetime(2010, 1, 1, 5, 30) == table.column('dt_b').to_pylist()[0]
+    assert [u'001', u'002', None] == table.column('ch_c').to_pylist()
+    assert [[u'001', u'002'], [u'002'], None] == [
+        v and sorted(v) for v in table.column('ch_d').to_pylist()]
+
+    if private == 'drop':
+        assert 'pr_e' not in table.schema.names
+    else:
+        assert [None, None, None] == table.column('pr_e').to_pylist()
+
+
+def test_write_arrow(db_session):
+    """
+    It should write dictionary-encoded choices to an Arrow IPC file
+    """
+    pyarrow = pytest.importorskip('pyarrow')
+    from distutils.version import LooseVersion
+    from occams_datastore import exports
+
+    _make_columnar_schema(db_session)
+
+    sink = pyarrow.BufferOutputStream()
+    count = exports.write_arrow(
+        db_session, u'A', sink, batch_size=2, use_choice_labels=True)
+    assert 3 == count
+
+    reader = pyarrow.ipc.open_file(sink.getvalue())
+    assert 2 == reader.num_record_batches
+    assert isinstance(
+        reader.schema.field_by_name('ch_c').type, pyarrow.DictionaryType)
+
+    if LooseVersion(pyarrow.__version__) < LooseVersion('1.0'):
+        # Older readers cannot resolve dictionaries after the first column
+        return
+
+    table = reader.read_all()
+    assert [u'Foo', u'Bar', None] == table.column('ch_c').to_pylist()
+
+
+def test_write_parquet_unsupported_private(db_session):
+    """
+    It should only support dropping or masking private columns
+    """
+    pytest.importorskip('pyarrow')
+    from six import BytesIO
+    from occams_datastore import exports
+
+    with pytest.raises(ValueError):
+        exports.write_parquet(db_session, u'A', BytesIO(), private='show')
+
+
+@pytest.yield_fixture
+def committed_schemata(sessionmaker):
+    """
+    Parallel exports read from separate connections, so the data needs
+    to be committed (and cleaned up afterwards)
+    """
+    from datetime import date
+    from occams_datastore import models
+
+    session = sessionmaker()
+    blame = models.User(key=u'exporter')
+    session.add(blame)
+    session.flush()
+    session.info['blame'] = blame
+
+    for name in (u'Export1', u'Export2'):
+        schema = models.Schema(
+            name=name,
+            title=name,
+            publish_date=date.today(),
+            attributes={
+                's1': models.Attribute(
+                    name=u's1',
+                    title=u'S1',
+                    type='section',
+                    order=0,
+                    attributes={
+                        'a': models.Attribute(
+                            name=u'a',
+                            title=u'',
+                            type='string',
+                            order=1)})})
+        for i in range(5):
+            entity = models.Entity(schema=schema)
+            entity['a'] = u'%s-%d' % (name, i)
+            session.add(entity)
+    session.commit()
+
+    yield [u'Export2', u'Export1']
+
+    session.execute(
+        models.Schema.__table__.delete()
+        .where(models.Schema.name.in_([u'Export1', u'Export2'])))
+    session.execute(
+        models.User.__table__.delete()
+        .where(models.User.key == u'exporter'))
+    session.commit()
+    session.close()
+
+
+@pytest.mark.parametrize('format', ['csv', 'jsonl'])
+def test_export_reports(engine, committed_schemata, tmpdir, format):
+    """
+    It should export schemata in parallel in deterministic order
+    """
+    import csv
+    import io
+    from occams_datastore import exports
+
+    paths = exports.export_reports(
+        engine.url, committed_schemata, str(tmpdir),
+        processes=2, shard_size=2, format=format)
+
+    assert [str(tmpdir.join('%s.%s' % (n, format)))
+            for n in committed_schemata] == paths
+    assert sorted(p.basename for p in tmpdir.listdir()) == \
+        sorted('%s.%s' % (n, format) for n in committed_schemata)
+
+    for name, path in zip(committed_schemata, paths):
+        with io.open(path, 'rb') as fp:
+            lines = fp.read().decode('utf-8').splitlines()
+        if format == 'csv':
+            rows = list(csv.DictReader(lines))
+        else:
+            rows = [json.loads(line) for line in lines]
+        assert [u'%s-%d' % (name, i) for i in range(5)] == \
+            [r['a'] for r in rows]
+
+
+def test_export_reports_unsupported_format(tmpdir):
+    """
+    It should refuse unsupported formats
+    """
+    from occams_datastore import exports
+
+    with pytest.raises(ValueError):
+        exports.export_reports('sqlite://', [], str(tmpdir), format='xls')
@@ -533,6 +533,70 @@ def test_build_report_expand_none_selected(db_session):
     assert result.a_003 is None
 
 
+def test_build_report_expand_multiple_versions(db_session):
+    """
+    It should aggregate expanded choices across a collection's versions
+    """
+    from copy import deepcopy
+    from datetime import date, timedelta
+    from occams_datastore import models, reporting
+
+    today = date.today()
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=today - timedelta(1),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='choice',
+                        is_collection=True,
+                        order=1,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Green', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Red', order=1)})})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    schema2 = deepcopy(schema1)
+    schema2.publish_date = today
+    schema2.attributes['a'].choices['003'] = models.Choice(
+        name=u'003', title=u'Blue', order=2)
+    db_session.add(schema2)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['a'] = [u'002']
+    entity2 = models.Entity(schema=schema2)
+    entity2['a'] = [u'001', u'003']
+    entity3 = models.Entity(schema=schema2)
+    db_session.add_all([entity1, entity2, entity3])
+    db_session.flush()
+
+    report = reporting.build_report(
+        db_session, u'A', expand_collections=True)
+    assert 'EXISTS' not in str(db_session.query(report).statement)
+    result = db_session.query(report).order_by(report.c.id).all()
+    assert [(r.a_001, r.a_002, r.a_003) for r in result] == [
+        (0, 1, None), (1, 0, 1), (None, None, None)]
+
+    report = reporting.build_report(
+        db_session, u'A', expand_collections=True, use_choice_labels=True)
+    result = db_session.query(report).order_by(report.c.id).all()
+    assert [(r.a_001, r.a_002, r.a_003) for r in result] == [
+        (None, u'Red', None), (u'Green', None, u'Blue'), (None, None, None)]
+
+
 def test_build_report_ids(db_session):
     """
     It should be able to include only the schemata with the specified ids
@@ -723,3 +787,1679 @@ def test_build_report_ignore_private(db_session):
     report = reporting.build_report(db_session, u'A', ignore_private=True)
     result = db_session.query(report).one()
     assert '[PRIVATE]' == result.name
+
+
+def test_iter_report_batches(db_session):
+    """
+    It should stream report rows in bounded batches ordered by entity
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    today = date.today()
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=today,
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='string',
+                        order=1)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    for i in range(5):
+        entity = models.Entity(schema=schema1)
+        entity['a'] = u'value%d' % i
+        db_session.add(entity)
+    db_session.flush()
+
+    report = reporting.build_report(db_session, u'A')
+    batches = list(reporting.iter_report(db_session, report, batch_size=2))
+
+    assert [2, 2, 1] == [len(b) for b in batches]
+    rows = [r for b in batches for r in b]
+    assert [u'value%d' % i for i in range(5)] == [r.a for r in rows]
+    assert sorted(r.id for r in rows) == [r.id for r in rows]
+
+
+@pytest.mark.parametrize('expand_collections,use_choice_labels', [
+    (False, False),
+    (False, True),
+    (True, False),
+    (True, True),
+])
+def test_iter_pivot_report_matches_build_report(
+        db_session, expand_collections, use_choice_labels):
+    """
+    It should generate the same rows as the joined report query
+    """
+
+    from datetime import date, datetime
+    from decimal import Decimal
+    from occams_datastore import models, reporting
+
+    today = date.today()
+
+    def choices():
+        return {
+            '001': models.Choice(name=u'001', title=u'Green', order=0),
+            '002': models.Choice(name=u'002', title=u'Red', order=1),
+            '003': models.Choice(name=u'003', title=u'Blue', order=2)}
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=today,
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    's_a': models.Attribute(
+                        name=u's_a', title=u'', type='string', order=1),
+                    'n_b': models.Attribute(
+                        name=u'n_b', title=u'', type='number', order=2),
+                    'd_c': models.Attribute(
+                        name=u'd_c', title=u'', type='date', order=3),
+                    'dt_d': models.Attribute(
+                        name=u'dt_d', title=u'', type='datetime', order=4),
+                    'ch_e': models.Attribute(
+                        name=u'ch_e', title=u'', type='choice', order=5,
+                        choices=choices()),
+                    'ch_f': models.Attribute(
+                        name=u'ch_f', title=u'', type='choice', order=6,
+                        is_collection=True, choices=choices()),
+                    'pr_g': models.Attribute(
+                        name=u'pr_g', title=u'', type='string', order=7,
+                        is_private=True)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['s_a'] = u'foo'
+    entity1['n_b'] = Decimal('1.5')
+    entity1['d_c'] = date(2010, 1, 1)
+    entity1['dt_d'] = datetime(2010, 1, 1, 5, 30)
+    entity1['ch_e'] = u'002'
+    entity1['ch_f'] = [u'001', u'003']
+    entity1['pr_g'] = u'secret'
+    entity2 = models.Entity(schema=schema1)
+    entity3 = models.Entity(schema=schema1)
+    entity3['ch_f'] = [u'002']
+    db_session.add_all([entity1, entity2, entity3])
+    db_session.flush()
+
+    options = dict(expand_collections=expand_collections,
+                   use_choice_labels=use_choice_labels)
+
+    report = reporting.build_report(db_session, u'A', **options)
+    expected = db_session.query(report).order_by(report.c.id).all()
+    result = [row
+              for batch in reporting.iter_pivot_report(
+                  db_session, u'A', batch_size=2, **options)
+              for row in batch]
+
+    assert len(expected) == len(result)
+    for expected_row, result_row in zip(expected, result):
+        assert expected_row.keys() == result_row.keys()
+        for key in expected_row.keys():
+            expected_value = getattr(expected_row, key)
+            result_value = getattr(result_row, key)
+            if key == 'ch_f':
+                expected_value = expected_value and \
+                    sorted(expected_value.split(';'))
+                result_value = result_value and \
+                    sorted(result_value.split(';'))
+            assert expected_value == result_value, key
+
+
+@pytest.mark.parametrize('use_choice_labels', [False, True])
+def test_build_report_use_choice_ids(db_session, use_choice_labels):
+    """
+    It should report choice ids that decode to the joined codes/labels
+    """
+
+    import re
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    today = date.today()
+
+    def choices():
+        return {
+            '001': models.Choice(name=u'001', title=u'Green', order=0),
+            '002': models.Choice(name=u'002', title=u'Red', order=1),
+            '003': models.Choice(name=u'003', title=u'Blue', order=2)}
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=today,
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'ch_e': models.Attribute(
+                        name=u'ch_e', title=u'', type='choice', order=1,
+                        choices=choices()),
+                    'ch_f': models.Attribute(
+                        name=u'ch_f', title=u'', type='choice', order=2,
+                        is_collection=True, choices=choices()),
+                    'ch_g': models.Attribute(
+                        name=u'ch_g', title=u'', type='choice', order=3,
+                        is_private=True, choices=choices())})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['ch_e'] = u'002'
+    entity1['ch_f'] = [u'001', u'003']
+    entity1['ch_g'] = u'001'
+    entity2 = models.Entity(schema=schema1)
+    db_session.add_all([entity1, entity2])
+    db_session.flush()
+
+    report = reporting.build_report(
+        db_session, u'A', use_choice_labels=use_choice_labels)
+    expected = db_session.query(report).order_by(report.c.id).all()
+
+    report = reporting.build_report(db_session, u'A', use_choice_ids=True)
+    statement = str(db_session.query(report).statement)
+    assert not re.search(r'\bchoice(_\d+)?\.', statement)
+
+    raw = db_session.query(report).order_by(report.c.id).all()
+    assert raw[0].ch_e == schema1.attributes['ch_e'].choices['002'].id
+
+    columns = reporting.build_columns(db_session, u'A')
+    result = list(reporting.decode_choices(
+        columns, raw, use_choice_labels=use_choice_labels))
+
+    assert len(expected) == len(result)
+    for expected_row, result_row in zip(expected, result):
+        assert expected_row.keys() == result_row.keys()
+        assert expected_row.ch_e == result_row.ch_e
+        assert expected_row.ch_g == result_row.ch_g
+        assert (sorted((expected_row.ch_f or u'').split(';'))
+                == sorted((result_row.ch_f or u'').split(';')))
+
+
+def _collections_schema(db_session):
+    """
+    Helper method to create a schema with several collections
+    """
+    from datetime import date
+    from occams_datastore import models
+
+    def choices():
+        return {
+            '001': models.Choice(name=u'001', title=u'Green', order=0),
+            '002': models.Choice(name=u'002', title=u'Red', order=1),
+            '003': models.Choice(name=u'003', title=u'Blue', order=2)}
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'ch_a': models.Attribute(
+                        name=u'ch_a', title=u'', type='choice', order=1,
+                        is_collection=True, choices=choices()),
+                    'ch_b': models.Attribute(
+                        name=u'ch_b', title=u'', type='choice', order=2,
+                        is_collection=True, choices=choices()),
+                    'ch_c': models.Attribute(
+                        name=u'ch_c', title=u'', type='choice', order=3,
+                        choices=choices())})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['ch_a'] = [u'001', u'003']
+    entity1['ch_b'] = [u'002']
+    entity1['ch_c'] = u'003'
+    entity2 = models.Entity(schema=schema1)
+    entity2['ch_b'] = [u'001']
+    entity3 = models.Entity(schema=schema1)
+    db_session.add_all([entity1, entity2, entity3])
+    db_session.flush()
+
+    return schema1
+
+
+@pytest.mark.parametrize('use_choice_labels,use_choice_ids', [
+    (False, False),
+    (True, False),
+    (False, True),
+])
+def test_build_report_aggregate_collections(
+        db_session, use_choice_labels, use_choice_ids):
+    """
+    It should aggregate collections the same as the correlated sub-queries
+    """
+    from occams_datastore import reporting
+
+    _collections_schema(db_session)
+
+    options = dict(use_choice_labels=use_choice_labels,
+                   use_choice_ids=use_choice_ids)
+
+    report = reporting.build_report(db_session, u'A', **options)
+    expected = db_session.query(report).order_by(report.c.id).all()
+
+    report = reporting.build_report(
+        db_session, u'A', aggregate_collections=True, **options)
+    statement = str(db_session.query(report).statement)
+    assert statement.count('value_choice AS') == 2  # ch_c, collections
+    result = db_session.query(report).order_by(report.c.id).all()
+
+    assert len(expected) == len(result)
+    for expected_row, result_row in zip(expected, result):
+        assert expected_row.keys() == result_row.keys()
+        assert expected_row.ch_c == result_row.ch_c
+        for key in ('ch_a', 'ch_b'):
+            expected_value = getattr(expected_row, key)
+            result_value = getattr(result_row, key)
+            assert (expected_value and sorted(expected_value.split(';'))) \
+                == (result_value and sorted(result_value.split(';'))), key
+
+
+def test_build_report_collection_arrays(db_session):
+    """
+    It should be able to report collections as arrays in PostgreSQL
+    """
+    from occams_datastore import reporting
+
+    if db_session.bind.url.drivername != 'postgresql':
+        with pytest.raises(NotImplementedError):
+            reporting.build_report(db_session, u'A', collection_arrays=True)
+        return
+
+    _collections_schema(db_session)
+
+    report = reporting.build_report(
+        db_session, u'A', collection_arrays=True)
+    result = db_session.query(report).order_by(report.c.id).all()
+    assert [(sorted(r.ch_a or []), r.ch_b) for r in result] == [
+        ([u'001', u'003'], [u'002']),
+        ([], [u'001']),
+        ([], None)]
+
+    report = reporting.build_report(
+        db_session, u'A', collection_arrays=True, use_choice_ids=True)
+    columns = reporting.build_columns(db_session, u'A')
+    rows = db_session.query(report).order_by(report.c.id).all()
+    result = list(reporting.decode_choices(
+        columns, rows, use_choice_labels=True))
+    assert [(sorted(r.ch_a or []), r.ch_b, r.ch_c) for r in result] == [
+        ([u'Blue', u'Green'], [u'Red'], u'Blue'),
+        ([], [u'Green'], None),
+        ([], None, None)]
+
+
+@pytest.mark.parametrize('expand_collections', [False, True])
+def test_build_report_chunk_size(db_session, expand_collections):
+    """
+    It should generate the same report when joining columns in chunks
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    today = date.today()
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=today,
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes=dict(
+                    [(u'q%d' % i, models.Attribute(
+                        name=u'q%d' % i,
+                        title=u'',
+                        type='string',
+                        order=i + 1))
+                     for i in range(5)]
+                    + [(u'm', models.Attribute(
+                        name=u'm',
+                        title=u'',
+                        type='choice',
+                        is_collection=True,
+                        order=6,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1)}))]))})
+    db_session.add(schema1)
+    db_session.flush()
+
+    for n in range(3):
+        entity = models.Entity(schema=schema1)
+        for i in range(5):
+            if (i + n) % 2:
+                entity[u'q%d' % i] = u'%d-%d' % (n, i)
+        entity[u'm'] = [u'002']
+        db_session.add(entity)
+    db_session.flush()
+
+    report = reporting.build_report(
+        db_session, u'A', expand_collections=expand_collections)
+    expected = db_session.query(report).order_by(report.c.id).all()
+
+    report = reporting.build_report(
+        db_session, u'A', expand_collections=expand_collections,
+        chunk_size=2)
+    result = db_session.query(report).order_by(report.c.id).all()
+
+    assert [c.name for c in report.columns] == expected[0].keys()
+    assert expected == result
+
+
+def test_build_columns_cached(db_session):
+    """
+    It should reuse cached column plans until the schema is modified
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='choice',
+                        is_collection=True,
+                        order=1,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1)})})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    expected = reporting.build_columns(
+        db_session, u'A', expand_collections=True)
+    assert (u'A', None, True, None) in reporting._column_plans
+
+    db_session.expire_all()
+    columns = reporting.build_columns(
+        db_session, u'A', expand_collections=True)
+    assert list(expected) == list(columns)
+    for name in columns:
+        assert expected[name].attributes == columns[name].attributes
+        assert expected[name].choice is columns[name].choice
+
+    # Modifying the schema discards the plan
+    schema1.attributes['a'].choices['001'].title = u'New Foo'
+    db_session.flush()
+    assert (u'A', None, True, None) not in reporting._column_plans
+    columns = reporting.build_columns(db_session, u'A')
+    assert u'New Foo' == columns['a'].choices['001']
+
+    schema1.retract_date = date.today()
+    db_session.flush()
+    assert 'a' not in reporting.build_columns(db_session, u'A')
+
+
+def test_build_columns_attributes(db_session):
+    """
+    It should only plan the lineages of the specified columns
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1),
+                    'a_b': models.Attribute(
+                        name=u'a_b',
+                        title=u'',
+                        type='choice',
+                        is_collection=True,
+                        order=2,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1)}),
+                    'c': models.Attribute(
+                        name=u'c', title=u'', type='string', order=3)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    columns = reporting.build_columns(
+        db_session, u'A', attributes=[u'c', u'a'])
+    assert [u'a', u'c'] == list(columns)
+    assert (u'A', None, False, (u'a', u'c')) in reporting._column_plans
+
+    # Expanded columns are found through their attribute
+    columns = reporting.build_columns(
+        db_session, u'A', expand_collections=True,
+        attributes=[u'a_b_002', u'x_y'])
+    assert [u'a_b_002'] == list(columns)
+    assert u'Bar' == columns[u'a_b_002'].choice.title
+
+    assert {} == reporting.build_columns(db_session, u'A', attributes=[])
+
+    report = reporting.build_report(db_session, u'A', attributes=[u'c'])
+    assert [u'c'] == [
+        c.name for c in report.columns
+        if c.name in (u'a', u'a_b', u'c')]
+
+
+def test_build_columns_cached_evicted(db_session, monkeypatch):
+    """
+    It should only keep the most recently used column plans
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    monkeypatch.setattr(reporting, 'COLUMN_PLANS_MAX_SIZE', 2)
+    reporting.invalidate_columns()
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1),
+                    'b': models.Attribute(
+                        name=u'b', title=u'', type='string', order=2),
+                    'c': models.Attribute(
+                        name=u'c', title=u'', type='string', order=3)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    reporting.build_columns(db_session, u'A', attributes=[u'a'])
+    reporting.build_columns(db_session, u'A', attributes=[u'b'])
+    reporting.build_columns(db_session, u'A', attributes=[u'a'])
+    reporting.build_columns(db_session, u'A', attributes=[u'c'])
+
+    assert [(u'A', None, False, (u'a',)),
+            (u'A', None, False, (u'c',))] == list(reporting._column_plans)
+
+
+def test_build_columns_cached_stale(db_session):
+    """
+    It should rebuild a cached plan that no longer exists in the database
+    """
+
+    from occams_datastore import reporting
+
+    reporting._column_plans[(u'A', None, False, None)] = (
+        reporting._schema_watermark(db_session, u'A'),
+        [(u'a', [-1], None)])
+    assert 0 == len(reporting.build_columns(db_session, u'A'))
+
+
+def test_build_columns_cached_rollback(db_session):
+    """
+    It should not reuse plans of metadata changes that were rolled back or
+    made by other processes
+    """
+
+    from copy import deepcopy
+    from datetime import date, timedelta
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1)})})
+    schema2 = deepcopy(schema1)
+    schema2.attributes['s1'].attributes['b'] = models.Attribute(
+        name=u'b', title=u'', type='string', order=2)
+    db_session.add_all([schema1, schema2])
+    db_session.flush()
+
+    db_session.begin_nested()
+    schema2.publish_date = date.today() + timedelta(1)
+    db_session.flush()
+    assert [u'a', u'b'] == list(reporting.build_columns(db_session, u'A'))
+    db_session.rollback()
+
+    assert [u'a'] == list(reporting.build_columns(db_session, u'A'))
+
+    # Publish without notifying this process
+    schema_table = models.Schema.__table__
+    db_session.execute(
+        schema_table.update()
+        .where(schema_table.c.id == schema2.id)
+        .values(
+            publish_date=date.today() + timedelta(1),
+            revision=schema_table.c.revision + 1))
+
+    assert [u'a', u'b'] == list(reporting.build_columns(db_session, u'A'))
+
+
+def test_create_report_view(db_session):
+    """
+    It should create a view with the same rows as the report
+    """
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1),
+                    'b': models.Attribute(
+                        name=u'b',
+                        title=u'',
+                        type='choice',
+                        is_collection=True,
+                        order=2,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'50%: Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u"Bar's", order=1)})})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['a'] = u'foo'
+    entity1['b'] = [u'001']
+    db_session.add(entity1)
+    db_session.flush()
+
+    options = dict(expand_collections=True, use_choice_labels=True)
+    assert reporting.create_report_view(db_session, u'A', **options)
+
+    report = reporting.build_report(db_session, u'A', **options)
+    expected = db_session.query(report).all()
+    result = db_session.execute('SELECT * FROM "report_A"').fetchall()
+    assert [tuple(r) for r in expected] == [tuple(r) for r in result]
+    assert u'50%: Foo' == result[0]['b_001']
+
+    # Retracted schemata no longer have a view
+    schema1.retract_date = date.today()
+    db_session.flush()
+    assert [] == reporting.refresh_report_views(db_session, [u'A'])
+    assert not db_session.bind.dialect.has_table(
+        db_session.connection(), 'report_A')
+
+
+def test_create_report_view_dates(db_session):
+    """
+    It should create a view of a report with date and time options
+    """
+    from datetime import date, datetime
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'd': models.Attribute(
+                        name=u'd', title=u'', type='date', order=1)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    for value in [date(2000, 1, 1), date(2020, 1, 1)]:
+        entity = models.Entity(schema=schema1)
+        entity['d'] = value
+        db_session.add(entity)
+    db_session.flush()
+
+    options = dict(
+        filters={'d': ('>=', date(2010, 1, 1))},
+        modified_since=datetime(2000, 1, 1, 12, 30))
+    assert reporting.create_report_view(db_session, u'A', **options)
+
+    report = reporting.build_report(db_session, u'A', **options)
+    expected = db_session.query(report).all()
+    result = db_session.execute('SELECT * FROM "report_A"').fetchall()
+    assert 1 == len(result)
+    assert [tuple(r) for r in expected] == [tuple(r) for r in result]
+
+    # Invalid options leave the existing view in place
+    with pytest.raises(ValueError):
+        reporting.create_report_view(
+            db_session, u'A', filters={'missing': ('=', 1)})
+    assert 1 == len(
+        db_session.execute('SELECT * FROM "report_A"').fetchall())
+
+
+def test_report_views_events(db_session):
+    """
+    It should regenerate the report views when schemata are published
+    """
+    from datetime import date
+    from sqlalchemy import inspect
+    from occams_datastore import models
+    from occams_datastore.models.events import registerReportViews
+
+    registerReportViews(db_session)
+
+    def view_columns():
+        names = inspect(db_session.connection()).get_view_names()
+        if 'report_A' not in names:
+            return None
+        return [c['name'] for c in
+                inspect(db_session.connection()).get_columns('report_A')]
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1)})})
+    db_session.add(schema1)
+    db_session.flush()
+    assert view_columns() is None
+
+    schema1.publish_date = date.today()
+    db_session.flush()
+    assert 'a' in view_columns()
+
+    schema1.attributes['s1'].attributes['b'] = models.Attribute(
+        schema=schema1, name=u'b', title=u'', type='string', order=2)
+    db_session.flush()
+    assert 'b' in view_columns()
+
+    schema1.retract_date = date.today()
+    db_session.flush()
+    assert view_columns() is None
+
+
+def test_report_views_events_drafts(db_session, monkeypatch):
+    """
+    It should not regenerate the report views when drafts are modified
+    """
+    from datetime import date
+    from occams_datastore import models
+    from occams_datastore.models import events
+
+    calls = []
+    monkeypatch.setattr(
+        events, 'refresh_report_views',
+        lambda session, names: calls.append(set(names)))
+    events.registerReportViews(db_session)
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a', title=u'', type='string', order=1)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    schema1.attributes['a'].title = u'A'
+    db_session.flush()
+    assert [] == calls
+
+    schema1.publish_date = date.today()
+    db_session.flush()
+    assert [set([u'A'])] == calls
+
+    schema1.attributes['a'].title = u'Changed'
+    db_session.flush()
+    assert [set([u'A']), set([u'A'])] == calls
+
+
+def test_materialize_report(db_session):
+    """
+    It should materialize a report and refresh it incrementally
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='string',
+                        order=1),
+                    'b': models.Attribute(
+                        name=u'b',
+                        title=u'',
+                        type='date',
+                        order=2)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['a'] = u'foo'
+    entity1['b'] = date(2010, 1, 1)
+    entity2 = models.Entity(schema=schema1)
+    entity2['a'] = u'bar'
+    db_session.add_all([entity1, entity2])
+    db_session.flush()
+
+    table = reporting.materialize_report(db_session, u'A')
+    assert 'A_report' == table.name
+
+    def contents():
+        return dict(
+            (row.id, (row.a, row.b))
+            for row in db_session.execute(table.select()))
+
+    assert {
+        entity1.id: (u'foo', date(2010, 1, 1)),
+        entity2.id: (u'bar', None)} == contents()
+
+    entity1['a'] = u'changed'
+    entity3 = models.Entity(schema=schema1)
+    entity3['a'] = u'new'
+    db_session.add(entity3)
+    db_session.delete(entity2)
+    db_session.flush()
+
+    table = reporting.materialize_report(db_session, u'A')
+    assert {
+        entity1.id: (u'changed', date(2010, 1, 1)),
+        entity3.id: (u'new', None)} == contents()
+
+
+def test_materialize_report_concurrent(sessionmaker):
+    """
+    It should pick up modifications of transactions that were in progress
+    during a refresh
+    """
+    from datetime import date
+    from sqlalchemy import select
+    from occams_datastore import models, reporting
+
+    session = sessionmaker()
+    if session.bind.url.drivername != 'postgresql':
+        session.close()
+        pytest.skip('Only PostgreSQL keeps track of transactions in progress')
+
+    def blamed():
+        other = sessionmaker()
+        other.info['blame'] = other.query(models.User).filter_by(
+            key=u'concurrent').one()
+        return other
+
+    refresher = slow = fast = None
+
+    try:
+        blame = models.User(key=u'concurrent')
+        session.add(blame)
+        session.flush()
+        session.info['blame'] = blame
+        schema = models.Schema(
+            name=u'A',
+            title=u'A',
+            publish_date=date.today(),
+            attributes={
+                's1': models.Attribute(
+                    name=u's1', title=u'S1', type='section', order=0,
+                    attributes={
+                        'a': models.Attribute(
+                            name=u'a', title=u'', type='string',
+                            order=1)})})
+        entities = [models.Entity(schema=schema) for i in range(2)]
+        for i, entity in enumerate(entities):
+            entity['a'] = u'old%d' % i
+        session.add_all(entities)
+        session.commit()
+        ids = [entity.id for entity in entities]
+
+        refresher = blamed()
+        table = reporting.materialize_report(refresher, u'A')
+        refresher.commit()
+
+        slow = blamed()
+        slow.query(models.Entity).get(ids[0])['a'] = u'slow'
+        slow.flush()
+
+        fast = blamed()
+        fast.query(models.Entity).get(ids[1])['a'] = u'fast'
+        fast.commit()
+
+        reporting.materialize_report(refresher, u'A')
+        refresher.commit()
+        slow.commit()
+        reporting.materialize_report(refresher, u'A')
+        refresher.commit()
+
+        contents = dict(
+            (row.id, row.a) for row in refresher.execute(table.select()))
+        assert {ids[0]: u'slow', ids[1]: u'fast'} == contents
+
+    finally:
+        for other in (session, refresher, slow, fast):
+            if other is not None:
+                other.rollback()
+                other.close()
+        # Only remove what this test committed, everything it created
+        # (including audit rows) was blamed on its own user
+        with session.bind.begin() as connection:
+            connection.execute('DROP TABLE IF EXISTS "A_report"')
+            watermark_table = models.ReportWatermark.__table__
+            connection.execute(
+                watermark_table.delete()
+                .where(watermark_table.c.name == u'A_report'))
+            users = models.User.__table__
+            user_ids = (
+                select([users.c.id]).where(users.c.key == u'concurrent'))
+            tables = models.DataStoreModel.metadata.sorted_tables
+            for table in reversed(tables):
+                if 'create_user_id' in table.c:
+                    connection.execute(
+                        table.delete()
+                        .where(table.c.create_user_id.in_(user_ids)))
+            connection.execute(
+                users.delete().where(users.c.key == u'concurrent'))
+
+
+def test_materialize_report_new_columns(db_session):
+    """
+    It should rebuild a materialized report if its columns change
+    """
+
+    from copy import deepcopy
+    from datetime import date, timedelta
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='string',
+                        order=1)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    table = reporting.materialize_report(db_session, u'A')
+    assert 'b' not in table.c
+
+    schema2 = deepcopy(schema1)
+    schema2.publish_date = date.today() + timedelta(1)
+    schema2.attributes['s1'].attributes['b'] = models.Attribute(
+        name=u'b',
+        title=u'',
+        type='number',
+        order=2)
+    db_session.add(schema2)
+    db_session.flush()
+
+    table = reporting.materialize_report(db_session, u'A')
+    assert 'b' in table.c
+    assert 0 == db_session.execute(table.count()).scalar()
+
+
+def test_materialize_report_new_metadata(db_session):
+    """
+    It should rebuild a materialized report if its metadata changes
+    """
+
+    from datetime import datetime
+    from occams_datastore import models, reporting
+
+    entities = _filters_schema(db_session)
+
+    # Only a later, unrelated entity moves the refresh watermark
+    past = datetime(2000, 1, 1)
+    for Model in [models.Entity] + list(set(models.nameModelMap.values())):
+        db_session.execute(
+            Model.__table__.update()
+            .values(create_date=past, modify_date=past))
+    db_session.expire_all()
+    db_session.add(models.Entity(schema=entities[0].schema))
+    db_session.flush()
+
+    table = reporting.materialize_report(
+        db_session, u'A', use_choice_labels=True)
+
+    choice = (
+        db_session.query(models.Choice)
+        .join(models.Choice.attribute)
+        .filter(models.Attribute.name == u'consent')
+        .filter(models.Choice.name == u'1')
+        .one())
+    choice.title = u'Agreed'
+    db_session.flush()
+
+    table = reporting.materialize_report(
+        db_session, u'A', use_choice_labels=True)
+    contents = dict(
+        (row.id, row.consent) for row in db_session.execute(table.select())
+        if row.id in [entity.id for entity in entities])
+    assert {
+        entities[0].id: u'Agreed',
+        entities[1].id: u'Agreed',
+        entities[2].id: u'No',
+        entities[3].id: None} == contents
+
+
+def _filters_schema(db_session):
+    """
+    Helper method to create a schema to filter on
+    """
+    from datetime import date
+    from decimal import Decimal
+    from occams_datastore import models
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'age': models.Attribute(
+                        name=u'age', title=u'', type='number', order=1),
+                    'consent': models.Attribute(
+                        name=u'consent', title=u'', type='choice', order=2,
+                        choices={
+                            '0': models.Choice(
+                                name=u'0', title=u'No', order=0),
+                            '1': models.Choice(
+                                name=u'1', title=u'Yes', order=1)}),
+                    'meds': models.Attribute(
+                        name=u'meds', title=u'', type='choice', order=3,
+                        is_collection=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1)}),
+                    'secret': models.Attribute(
+                        name=u'secret', title=u'', type='string', order=4,
+                        is_private=True)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entities = []
+    for age, consent, meds in [(Decimal('17'), u'1', [u'001']),
+                               (Decimal('18'), u'1', [u'001', u'002']),
+                               (Decimal('40'), u'0', []),
+                               (None, None, [u'002'])]:
+        entity = models.Entity(schema=schema1)
+        entity['age'] = age
+        entity['consent'] = consent
+        entity['meds'] = meds
+        entities.append(entity)
+    db_session.add_all(entities)
+    db_session.flush()
+
+    return entities
+
+
+@pytest.mark.parametrize('filters,expected', [
+    ({'age': ('>=', 18)}, [1, 2]),
+    ({'age': ('<', 18)}, [0]),
+    ({'age': ('!=', 18)}, [0, 2]),
+    ({'age': ('in', [17, 40])}, [0, 2]),
+    ({'consent': ('=', u'1')}, [0, 1]),
+    ({'consent': ('!=', u'1')}, [2]),
+    ({'meds': ('=', u'002')}, [1, 3]),
+    ({'meds': ('in', [u'001', u'002'])}, [0, 1, 3]),
+    ({'age': ('>=', 18), 'consent': ('=', u'1')}, [1]),
+])
+def test_build_report_filters(db_session, filters, expected):
+    """
+    It should only include entities with values matching the filters
+    """
+    from occams_datastore import reporting
+
+    entities = _filters_schema(db_session)
+
+    report = reporting.build_report(db_session, u'A', filters=filters)
+    statement = str(db_session.query(report).statement)
+    assert statement.count('EXISTS') == len(filters)
+    result = db_session.query(report.c.id).order_by(report.c.id).all()
+    assert [entities[i].id for i in expected] == [r.id for r in result]
+
+    result = [row.id
+              for batch in reporting.iter_pivot_report(
+                  db_session, u'A', filters=filters)
+              for row in batch]
+    assert [entities[i].id for i in expected] == result
+
+
+@pytest.mark.parametrize('filters', [
+    {'missing': ('=', 1)},
+    {'age': ('~', 1)},
+    {'consent': ('>', u'0')},
+    {'consent': ('=', u'2')},
+    {'consent': ('=', 1)},
+    {'consent': ('in', u'1')},
+    {'age': ('in', 17)},
+    {'secret': ('=', u'foo')},
+])
+def test_build_report_filters_invalid(db_session, filters):
+    """
+    It should not allow invalid filters
+    """
+    from occams_datastore import reporting
+
+    _filters_schema(db_session)
+
+    with pytest.raises(ValueError):
+        reporting.build_report(db_session, u'A', filters=filters)
+
+
+def test_report_page(db_session):
+    """
+    It should page through a report by entity id
+    """
+    from occams_datastore import reporting
+
+    entities = _filters_schema(db_session)
+    ids = [entity.id for entity in entities]
+
+    pages = []
+    after_id = None
+    while True:
+        page = reporting.report_page(
+            db_session, u'A', after_id=after_id, page_size=3)
+        if not page:
+            break
+        pages.append([row.id for row in page])
+        after_id = page[-1].id
+
+    assert [ids[:3], ids[3:]] == pages
+
+    page = reporting.report_page(
+        db_session, u'A', after_id=ids[0], page_size=1,
+        filters={'consent': ('=', u'0')})
+    assert [ids[2]] == [row.id for row in page]
+    assert page[0].age == 40
+
+    report = reporting.build_report(db_session, u'A', limit=2)
+    statement = str(db_session.query(report).statement)
+    # The entities are limited in a sub-query, not the pivoted report
+    assert 'LIMIT' in statement.split('IN (SELECT', 1)[1]
+    assert 'LIMIT' not in statement.split('IN (SELECT', 1)[0]
+
+
+@pytest.mark.parametrize('options', [
+    {'expand_collections': True, 'chunk_size': 1},
+    {'aggregate_collections': True, 'chunk_size': 2},
+    {'aggregate_collections': True},
+])
+def test_report_page_restricted(db_session, options):
+    """
+    It should not aggregate or join chunks of entities outside of the page
+    """
+    from occams_datastore import reporting
+
+    entities = _filters_schema(db_session)
+    ids = [entity.id for entity in entities]
+
+    def normalize(row):
+        # Collections are concatenated in no particular order
+        return tuple(
+            ';'.join(sorted(v.split(';'))) if hasattr(v, 'split') else v
+            for v in row)
+
+    expected = [
+        normalize(row) for row in
+        db_session.query(reporting.build_report(db_session, u'A', **options))
+        if row.id in ids[1:3]]
+    page = reporting.report_page(
+        db_session, u'A', after_id=ids[0], page_size=2, **options)
+    assert expected == [normalize(row) for row in page]
+
+    report = reporting.build_report(db_session, u'A', limit=2, **options)
+    statement = str(db_session.query(report).statement)
+    chunks = statement.count(') AS "A_')
+    aggregates = statement.count('GROUP BY')
+    assert aggregates
+    # The page itself, and every chunk and aggregate is limited to the page
+    assert 1 + chunks + aggregates == statement.count('LIMIT')
+
+
+def test_build_report_expand_restricted(db_session):
+    """
+    It should only aggregate the expanded collections of reported entities
+    """
+    from occams_datastore import reporting
+
+    entities = _filters_schema(db_session)
+    ids = [entity.id for entity in entities]
+
+    page = reporting.report_page(
+        db_session, u'A', after_id=ids[0], page_size=2,
+        expand_collections=True)
+    assert [(ids[1], 1, 1), (ids[2], None, None)] == [
+        (row.id, row.meds_001, row.meds_002) for row in page]
+
+    report = reporting.build_report(
+        db_session, u'A', limit=2, expand_collections=True)
+    statement = str(db_session.query(report).statement)
+    aggregate = statement.split('GROUP BY', 1)[0].rsplit('max(CASE', 1)[1]
+    assert '.entity_id IN (SELECT' in aggregate
+    assert 'LIMIT' in aggregate
+
+    report = reporting.build_report(
+        db_session, u'A', expand_collections=True)
+    statement = str(db_session.query(report).statement)
+    assert '.entity_id IN (SELECT' not in statement
+
+
+@pytest.mark.parametrize('expand_collections', [False, True])
+def test_build_report_arrays(db_session, expand_collections):
+    """
+    It should load reports into typed column arrays
+    """
+    numpy = pytest.importorskip('numpy')
+    from datetime import date, datetime
+    from decimal import Decimal
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    's_a': models.Attribute(
+                        name=u's_a', title=u'', type='string', order=1),
+                    'n_b': models.Attribute(
+                        name=u'n_b', title=u'', type='number', order=2),
+                    'd_c': models.Attribute(
+                        name=u'd_c', title=u'', type='date', order=3),
+                    'dt_d': models.Attribute(
+                        name=u'dt_d', title=u'', type='datetime', order=4),
+                    'ch_e': models.Attribute(
+                        name=u'ch_e', title=u'', type='choice', order=5,
+                        choices={
+                            '002': models.Choice(
+                                name=u'002', title=u'Red', order=0),
+                            '001': models.Choice(
+                                name=u'001', title=u'Green', order=1)}),
+                    'ch_f': models.Attribute(
+                        name=u'ch_f', title=u'', type='choice', order=6,
+                        is_collection=True,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Green', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Red', order=1)})})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['s_a'] = u'foo'
+    entity1['n_b'] = Decimal('1.5')
+    entity1['d_c'] = date(2010, 1, 1)
+    entity1['dt_d'] = datetime(2010, 1, 1, 5, 30)
+    entity1['ch_e'] = u'002'
+    entity1['ch_f'] = [u'001', u'002']
+    entity2 = models.Entity(schema=schema1)
+    db_session.add_all([entity1, entity2])
+    db_session.flush()
+
+    result = reporting.build_report_arrays(
+        db_session, u'A', batch_size=1,
+        expand_collections=expand_collections)
+
+    assert 2 == len(result)
+    assert [entity1.id, entity2.id] == result['id'].tolist()
+    assert numpy.int64 == result['id'].dtype
+    assert [u'foo', None] == result['s_a'].tolist()
+    assert [1.5, None] == result['n_b'].tolist()
+    assert numpy.float64 == result['n_b'].dtype
+    assert [date(2010, 1, 1), None] == result['d_c'].tolist()
+    assert [datetime(2010, 1, 1, 5, 30), None] == result['dt_d'].tolist()
+    assert [1, None] == result['ch_e'].tolist()
+    assert [(u'001', u'Green'), (u'002', u'Red')] == \
+        list(result.categories['ch_e'].items())
+
+    if expand_collections:
+        assert [1, None] == result['ch_f_001'].tolist()
+        assert [1, None] == result['ch_f_002'].tolist()
+    else:
+        assert [[u'001', u'002'], None] == [
+            v and sorted(v.split(';')) for v in result['ch_f'].tolist()]
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_report_cache(db_session, monkeypatch, tmpdir, on_disk):
+    """
+    It should reuse report results until the schema's data changes
+    """
+    from occams_datastore import reporting
+
+    entities = _filters_schema(db_session)
+
+    calls = []
+    build_report = reporting.build_report
+
+    def counted_build_report(*args, **kw):
+        calls.append(args[1])
+        return build_report(*args, **kw)
+
+    monkeypatch.setattr(reporting, 'build_report', counted_build_report)
+
+    cache = reporting.ReportCache(
+        max_size=2, directory=str(tmpdir) if on_disk else None)
+
+    result = cache.get(db_session, u'A')
+    assert [e.id for e in entities] == [r.id for r in result]
+    assert 1 == len(calls)
+
+    result = cache.get(db_session, u'A')
+    assert [e.id for e in entities] == [r.id for r in result]
+    assert [17, 18, 40, None] == [r.age for r in result]
+    assert 1 == len(calls)
+
+    # Different options are cached separately
+    cache.get(db_session, u'A', attributes=[u'age'])
+    assert 2 == len(calls)
+
+    # Updated values move the watermark
+    entities[0]['age'] = 21
+    db_session.flush()
+    result = cache.get(db_session, u'A')
+    assert 3 == len(calls)
+    assert 21 == result[0].age
+
+    # Deleted entities move the watermark
+    db_session.delete(entities[3])
+    db_session.flush()
+    result = cache.get(db_session, u'A')
+    assert 4 == len(calls)
+    assert 3 == len(result)
+
+    # Least recently used results are evicted
+    cache.get(db_session, u'A', filters={'age': ('>', 18)})
+    cache.get(db_session, u'A', attributes=[u'age'])
+    assert 6 == len(calls)
+    assert 2 == len(cache)
+
+    cache.clear()
+    assert 0 == len(cache)
+    if on_disk:
+        assert [] == tmpdir.listdir()
+
+
+def test_report_cache_directory(db_session, monkeypatch, tmpdir):
+    """
+    It should pick up the results kept on disk by earlier caches
+    """
+    from occams_datastore import reporting
+
+    _filters_schema(db_session)
+
+    cache = reporting.ReportCache(max_size=2, directory=str(tmpdir))
+    cache.get(db_session, u'A')
+    cache.get(db_session, u'A', attributes=[u'age'])
+    cache.get(db_session, u'A', attributes=[u'consent'])
+    assert 2 == len(tmpdir.listdir())
+
+    calls = []
+    build_report = reporting.build_report
+
+    def counted_build_report(*args, **kw):
+        calls.append(args[1])
+        return build_report(*args, **kw)
+
+    monkeypatch.setattr(reporting, 'build_report', counted_build_report)
+
+    cache = reporting.ReportCache(max_size=1, directory=str(tmpdir))
+    assert 1 == len(cache)
+    assert 1 == len(tmpdir.listdir())
+
+    # Only the most recently used result was kept
+    cache.get(db_session, u'A', attributes=[u'consent'])
+    assert [] == calls
+
+    cache.clear()
+    assert [] == tmpdir.listdir()
+
+
+def test_report_cache_threads():
+    """
+    It should be safe to share between threads
+    """
+    import threading
+    from occams_datastore import reporting
+
+    cache = reporting.ReportCache(max_size=2)
+    errors = []
+
+    def work(offset):
+        try:
+            for i in range(2000):
+                key = str((i + offset) % 5)
+                if cache._load(key) is None:
+                    cache._store(key, (None, ([], [])))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [] == errors
+    assert 2 == len(cache)
+
+
+def test_report_cache_choice_labels(db_session):
+    """
+    It should regenerate cached results when the schema's choices change
+    """
+    from occams_datastore import models, reporting
+
+    _filters_schema(db_session)
+
+    cache = reporting.ReportCache()
+
+    result = cache.get(db_session, u'A', use_choice_labels=True)
+    assert [u'Yes', u'Yes', u'No', None] == [r.consent for r in result]
+
+    choice = (
+        db_session.query(models.Choice)
+        .join(models.Choice.attribute)
+        .filter(models.Attribute.name == u'consent')
+        .filter(models.Choice.name == u'1')
+        .one())
+    choice.title = u'Agreed'
+    db_session.flush()
+
+    result = cache.get(db_session, u'A', use_choice_labels=True)
+    assert [u'Agreed', u'Agreed', u'No', None] == [r.consent for r in result]
+
+
+def test_build_report_modified(db_session):
+    """
+    It should only include entities modified within the specified range
+    """
+
+    from datetime import date, datetime
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='string',
+                        order=1)})})
+    db_session.add(schema1)
+    db_session.flush()
+
+    past = datetime(2000, 1, 1)
+    cutoff = datetime(2010, 1, 1)
+
+    # Not touched since the cutoff
+    entity1 = models.Entity(
+        schema=schema1, create_date=past, modify_date=past)
+    # Only its values were modified since the cutoff
+    entity2 = models.Entity(
+        schema=schema1, create_date=past, modify_date=past)
+    entity2['a'] = u'foo'
+    # Modified since the cutoff
+    entity3 = models.Entity(schema=schema1)
+    db_session.add_all([entity1, entity2, entity3])
+    db_session.flush()
+
+    report = reporting.build_report(db_session, u'A', modified_since=cutoff)
+    result = [r.id for r in db_session.query(report).order_by(report.c.id)]
+    assert [entity2.id, entity3.id] == result
+
+    report = reporting.build_report(db_session, u'A', modified_until=cutoff)
+    result = [r.id for r in db_session.query(report).order_by(report.c.id)]
+    assert [entity1.id, entity2.id] == result
+
+
+def test_build_report_modified_removed(db_session):
+    """
+    It should report entities that only had collection values removed
+    """
+
+    from datetime import date, datetime
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='choice',
+                        is_collection=True,
+                        order=1,
+                        choices={
+                            '001': models.Choice(
+                                name=u'001', title=u'Foo', order=0),
+                            '002': models.Choice(
+                                name=u'002', title=u'Bar', order=1),
+                            '003': models.Choice(
+                                name=u'003', title=u'Baz', order=2)})})})
+    entity1 = models.Entity(schema=schema1)
+    entity1['a'] = [u'001', u'002', u'003']
+    db_session.add(entity1)
+    db_session.flush()
+
+    past = datetime(2000, 1, 1)
+    cutoff = datetime(2010, 1, 1)
+
+    for Model in (models.Entity, models.ValueChoice):
+        db_session.execute(
+            Model.__table__.update()
+            .values(create_date=past, modify_date=past))
+    db_session.expire_all()
+
+    report = reporting.build_report(db_session, u'A', modified_since=cutoff)
+    assert [] == db_session.query(report).all()
+
+    entity1['a'] = [u'001', u'002']
+    db_session.flush()
+
+    report = reporting.build_report(db_session, u'A', modified_since=cutoff)
+    result = db_session.query(report).one()
+    assert entity1.id == result.id
+    assert sorted([u'001', u'002']) == sorted(result.a.split(';'))
+
+
+def test_build_deleted_report(db_session):
+    """
+    It should list the entities that have been deleted
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(name=u'A', title=u'A', publish_date=date.today())
+    entity1 = models.Entity(schema=schema1)
+    entity2 = models.Entity(schema=schema1)
+    db_session.add_all([entity1, entity2])
+    db_session.flush()
+    deleted_id = entity2.id
+
+    report = reporting.build_deleted_report(db_session, u'A')
+    assert [] == db_session.query(report).all()
+
+    db_session.delete(entity2)
+    db_session.flush()
+
+    report = reporting.build_deleted_report(db_session, u'A')
+    result = db_session.query(report).one()
+    assert deleted_id == result.id
+    assert u'A' == result.form_name
+
+
+@pytest.mark.parametrize('explain', [False, True])
+def test_profile_report(db_session, explain):
+    """
+    It should record timings and (optionally) the query plan of a report
+    """
+
+    from datetime import date
+    from occams_datastore import models, reporting
+
+    schema1 = models.Schema(
+        name=u'A',
+        title=u'A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name=u's1',
+                title=u'S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name=u'a',
+                        title=u'',
+                        type='string',
+                        order=1)})})
+    db_session.add(schema1)
+    db_session.add(models.Entity(schema=schema1))
+    db_session.add(models.Entity(schema=schema1))
+    db_session.flush()
+
+    profile = reporting.profile_report(db_session, u'A', explain=explain)
+
+    assert profile.plan_time >= 0
+    assert profile.build_time >= profile.plan_time
+    assert profile.compile_time >= 0
+    assert profile.execute_time >= 0
+    assert 2 == profile.row_count
+    assert 'SELECT' in profile.sql
+    if explain:
+        assert profile.explain
+    else:
+        assert profile.explain is None
+    assert 2 == profile.to_json()['row_count']
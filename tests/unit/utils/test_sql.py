@@ -166,6 +166,20 @@ def test_group_concat_postgresql_invalid_args(db_session):
         result, = query.one()
 
 
+def test_group_concat_duckdb():
+    """
+    It should compile group_concat for DuckDB
+    """
+    from sqlalchemy import literal_column, select
+    from occams_datastore.analytics import DuckDBDialect
+    from occams_datastore.utils.sql import group_concat
+
+    statement = select([group_concat(literal_column('name'), ';')])
+    compiled = str(statement.compile(
+        dialect=DuckDBDialect(), compile_kwargs={'literal_binds': True}))
+    assert "STRING_AGG(name, ';')" in compiled
+
+
 def test_to_date(db_session):
     """
     It should be able to cast to a date
@@ -230,3 +244,23 @@ def test_json_native_postgresql(db_session):
         pytest.skip('Not using PostgreSQL')
 
     assert SomeMapping.value.type.compile(db_session.bind.dialect) == 'JSON'
+
+
+def test_compile_literal(db_session):
+    """
+    It should render date and time parameters inline
+    """
+    import datetime
+    from sqlalchemy import Date, DateTime, literal, select
+    from occams_datastore.utils.sql import compile_literal
+
+    date = datetime.date(1976, 7, 4)
+    timestamp = datetime.datetime(1976, 7, 4, 5, 0)
+    statement = select([
+        literal(date, Date).label('date'),
+        literal(timestamp, DateTime).label('timestamp'),
+        literal(1).label('number')])
+    compiled = compile_literal(statement, db_session.bind.dialect)
+
+    result = db_session.execute(str(compiled)).first()
+    assert [str(date), str(timestamp), '1'] == [str(v) for v in result]